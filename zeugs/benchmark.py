@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmark.py
+
+Last updated:  2020-02-05
+
+Time the main stages of the report pipeline on synthetic schools of
+various sizes, so that performance regressions can be detected.
+
+For each "profile" (number of pupils in the school, number of subjects
+per class) a complete user-data folder is generated in a temporary
+folder: the configuration and templates are copied from the test data,
+the pupil, subject and teacher tables are generated. Then the following
+stages are timed:
+    importPupils    – the pupil table of the previous year
+    migratePupils   – to the benchmark year
+    grades2db       – grades for all pupils of class 10, term 2
+    db2grades
+    makeGradeTable
+    makeReports     – the grade reports for class 10
+    makeSheets      – the text report cover sheets for class 10
+Each stage is run <repeat> times. The time of the first run ("cold",
+e.g. with empty caches) and the best time are recorded, together with
+the breakdown of the first run (see <wz_core.timing>).
+
+The pupils are distributed over the classes 05 to 13. Of the subjects of
+a class only as many are graded as there are places in the report
+template (the subjects are taken from GRADES.ORDERING), the others are
+only relevant for text reports. The grade table template is extended if
+there are more pupils than rows.
+
+The results can be saved as a baseline (--save). Later runs are compared
+with the baseline: stages which have become slower (by more than the
+given tolerance) are listed and the program exits with status 1.
+
+Usage:
+    benchmark.py [--pupils N ...] [--subjects N ...] [--repeat N]
+            [--baseline FILE] [--save] [--tolerance PERCENT] [--keep]
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+_PUPILS = (10, 100, 500, 2000)  # default school sizes
+_SUBJECTS = (5, 20, 40)         # default numbers of subjects per class
+_REPEAT = 3
+_TOLERANCE = 25                 # percent
+_MINDIFF = 0.05                 # seconds, smaller differences are ignored
+_BASELINE = 'benchmark_baseline.json'
+
+_YEAR = 2020                    # the benchmark school-year
+_TERM = '2'
+_KLASS = '10'                   # the class for the class-based stages
+_DATE = '2020-06-19'
+_CLASSES = ['%02d' % k for k in range(5, 14)]
+_STREAMS = ('Gym', 'RS', 'HS')
+
+import os, sys, re, json, random, shutil, tempfile, argparse, datetime
+from collections import OrderedDict
+
+from wz_core.configuration import init, Paths
+from wz_core.pupils import Pupils, Klass
+from wz_core.timing import Timing
+from wz_compat.import_pupils import importPupils
+from wz_compat.migrate import migratePupils
+from wz_compat.template import getGradeTemplate, getTemplateTags
+from wz_table.dbtable import makeDBTable
+from wz_grades.gradedata import grades2db, db2grades
+from wz_grades.gradetable import makeGradeTable
+from wz_grades.makereports import makeReports
+from wz_text.coversheet import makeSheets
+
+ZEUGS = os.path.dirname(os.path.realpath(__file__))
+TESTDATA = os.path.join(os.path.dirname(ZEUGS), 'TestData')
+
+
+def profileName(npupils, nsubjects):
+    return 'p%d-s%d' % (npupils, nsubjects)
+
+
+
+class SyntheticSchool:
+    """Generate the data for a synthetic school in a new user-data folder.
+    """
+    def __init__(self, folder, npupils, nsubjects, seed=0):
+        self.folder = folder
+        self.npupils = npupils
+        self.nsubjects = nsubjects
+        self.random = random.Random(seed)
+        for d in 'conf', 'Vorlagen':
+            shutil.copytree(os.path.join(TESTDATA, d),
+                    os.path.join(folder, d))
+
+
+    def build(self):
+        """Generate the tables. Must be called after <init>.
+        Return the path of the pupil table for the previous year.
+        """
+        self.makeSubjects()
+        self.makeTeachers()
+        self.extendGradeTable()
+        return self.makePupils()
+
+
+    def makePupils(self):
+        """Make the pupil table for the year before <_YEAR>, for import
+        by <importPupils>.
+        """
+        fields = CONF.TABLES.PUPILS_FIELDNAMES
+        year = _YEAR - 1
+        rows = []
+        for n in range(self.npupils):
+            klass = _CLASSES[n % len(_CLASSES)]
+            age = int(klass) + 6
+            firstname = 'Vorname%d' % n
+            lastname = 'Name%04d' % self.random.randrange(10000)
+            values = {
+                'PID': '%06d' % (100000 + n),
+                'CLASS': klass,
+                'PSORT': '%s %s' % (lastname, firstname),
+                'FIRSTNAME': firstname,
+                'LASTNAME': lastname,
+                'STREAM': (self.random.choice(_STREAMS)
+                        if int(klass) >= 9 else None),
+                'FIRSTNAMES': firstname + ' Maria',
+                'DOB_D': '%d-%02d-%02d' % (year - age,
+                        self.random.randint(1, 12),
+                        self.random.randint(1, 28)),
+                'POB': 'Ort%d' % self.random.randrange(50),
+                'SEX': self.random.choice('mw'),
+                'HOME': 'Ort%d' % self.random.randrange(50),
+                'ENTRY_D': '%d-08-01' % (year - int(klass) + 1),
+            }
+            rows.append([values.get(f) for f in fields])
+        folder = Paths.getYearPath(year, 'DIR_SCHOOLDATA', make=1)
+        filepath = os.path.join(folder, 'Schueler_synthetisch')
+        makeDBTable(filepath, "** Schüler **", fields.values(), rows,
+                [("Schuljahr", year)])
+        return filepath
+
+
+    def gradedSubjects(self):
+        """Return the list of subjects for the grade reports of <_KLASS>:
+        those in the subject groups of GRADES.ORDERING which have places
+        in the report template.
+        """
+        klass = Klass(_KLASS)
+        rtype = klass.match_map(CONF.GRADES.REPORT_TEMPLATES['_' + _TERM])
+        slots = {}
+        for tag in getTemplateTags(getGradeTemplate(rtype, klass)):
+            m = re.fullmatch(r'(?:.*\.)?([^._]+)_\d+', tag)
+            if m:
+                slots[m.group(1)] = slots.get(m.group(1), 0) + 1
+        # The larger groups first
+        sids = []
+        for group, n in sorted(slots.items(), key=lambda x: (-x[1], x[0])):
+            sids += [sid for sid in CONF.GRADES.ORDERING[group]
+                    if not sid.startswith('_')][:n]
+        return sids
+
+
+    def makeSubjects(self):
+        """Make the subject table for <_YEAR>: <nsubjects> for each class,
+        as many as possible of these graded.
+        """
+        sids = self.gradedSubjects()[:self.nsubjects]
+        self.subjects = [(sid, sid, False) for sid in sids]
+        self.subjects += [('T%02d' % i, 'Textfach %d' % i, True)
+                for i in range(self.nsubjects - len(sids))]
+        rows = []
+        for i, (sid, name, textonly) in enumerate(self.subjects):
+            tid = 'L%02d' % i
+            rows.append([sid, name, None]
+                    + [('*' if textonly else '') + tid] * len(_CLASSES))
+        filepath = Paths.getYearPath(_YEAR, 'FILE_SUBJECTS', make=-1)
+        makeDBTable(filepath, "Fächer", ['%id', 'Kurs', '#'] + _CLASSES,
+                rows)
+
+
+    def makeTeachers(self):
+        fields = CONF.TABLES.TEACHER_FIELDNAMES
+        rows = []
+        for i in range(len(self.subjects)):
+            tid = 'L%02d' % i
+            values = {'NAME': 'Lehrkraft %d' % i,
+                    'SHORTNAME': 'Lehrkraft_%d' % i,
+                    'MAIL': '%s@schule.de' % tid.lower(),
+                    'PERMISSION': 'u'}
+            rows.append([tid] + [values.get(f) for f in fields])
+        filepath = Paths.getYearPath(_YEAR, 'FILE_TEACHERDATA', make=-1)
+        makeDBTable(filepath, "Lehrkräfte", ['%id'] + list(fields.values()),
+                rows)
+
+
+    def extendGradeTable(self):
+        """Make sure that the grade table template for <_KLASS> has enough
+        pupil rows (marked by 'X' in the first column).
+        """
+        from openpyxl import load_workbook
+        klass = Klass(_KLASS)
+        t = klass.match_map(CONF.GRADES.GRADE_TABLE_INFO.GRADE_TABLE_TEMPLATE)
+        filepath = Paths.getUserPath('FILE_GRADE_TABLE_TEMPLATE').replace(
+                '*', t) + '.xlsx'
+        wb = load_workbook(filepath)
+        ws = wb.active
+        xrows = [cell.row for cell in ws['A'] if cell.value == 'X']
+        # Pupils of class 09 move up to class 10
+        need = self.npupils // len(_CLASSES) + 1 - len(xrows)
+        if need > 0:
+            ws.insert_rows(xrows[-1] + 1, need)
+            for row in range(xrows[-1] + 1, xrows[-1] + 1 + need):
+                ws.cell(row=row, column=1, value='X')
+            wb.save(filepath)
+
+
+    def gradeTable(self):
+        """Return a grade table for <grades2db> with grades for all pupils
+        of <_KLASS> in all graded subjects.
+        """
+        grades = list(CONF.GRADES.GRADES.VALID)[:16]
+        gtable = OrderedDict()
+        gtable.info = {'SCHOOLYEAR': str(_YEAR), 'CLASS': _KLASS,
+                'TERM': _TERM}
+        for pdata in Pupils(_YEAR).classPupils(Klass(_KLASS)):
+            gtable[pdata['PID']] = {sid: self.random.choice(grades)
+                    for sid, name, textonly in self.subjects
+                    if not textonly}
+        return gtable
+
+
+
+def copyTable(gtable):
+    table = OrderedDict(gtable)
+    table.info = gtable.info
+    return table
+
+
+def timeStage(repeat, f, *args):
+    """Run <f(*args)> <repeat> times.
+    Return a result mapping: {'cold': time of first run, 'best': best
+    time, 'stages': timing breakdown of first run}, or – if the stage
+    failed – {'failed': True}.
+    """
+    result = {}
+    times = []
+    for i in range(repeat):
+        token = Timing.begin()
+        try:
+            f(*args)
+        except (REPORT.RuntimeFail, REPORT.RuntimeBug):
+            Timing.end(token)
+            result['failed'] = True
+            break
+        finally:
+            errors = [m for m in REPORT.messages() if m[0] >= 6]
+            for mi, mt, msg in errors:
+                print("  ***", mt, msg)
+        seconds, breakdown = Timing.end(token)
+        times.append(seconds)
+        if i == 0:
+            result['cold'] = seconds
+            result['stages'] = breakdown
+    if times:
+        result['best'] = min(times)
+    return result
+
+
+def runProfile(npupils, nsubjects, repeat, keep=False):
+    """Generate a synthetic school and time the stages.
+    Return a mapping {stage -> result (see <timeStage>)}.
+    """
+    folder = tempfile.mkdtemp(prefix='zeugs-bench-')
+    try:
+        school = SyntheticSchool(folder, npupils, nsubjects)
+        init(folder)
+        if Paths.getUserFolder() != folder:
+            REPORT.Fail("Benutzerordner ist %s (Testmodus?)"
+                    % Paths.getUserFolder())
+        Timing.enabled = True
+        pupilfile = school.build()
+        klass = Klass(_KLASS)
+        results = OrderedDict()
+        def stage(name, f, *args, n=repeat):
+            results[name] = timeStage(n, f, *args)
+            r = results[name]
+            print("  %-16s" % name, "FAILED" if 'failed' in r
+                    else "cold %8.3f s, best %8.3f s" % (r['cold'], r['best']))
+        stage('importPupils', importPupils, _YEAR - 1, pupilfile)
+        stage('migratePupils', migratePupils, _YEAR)
+        # <grades2db> consumes the table, so pass a copy to each run
+        gtable = school.gradeTable()
+        stage('grades2db', lambda: grades2db(_YEAR, copyTable(gtable),
+                _TERM))
+        stage('db2grades', db2grades, _YEAR, _TERM, klass)
+        stage('makeGradeTable', makeGradeTable, _YEAR, _TERM, klass,
+                "Benchmark")
+        stage('makeReports', makeReports, _YEAR, _TERM, klass, _DATE)
+        stage('makeSheets', makeSheets, _YEAR, _DATE, klass)
+        return results
+    finally:
+        if keep:
+            print("  Daten:", folder)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """Compare the best times with those of the baseline.
+    Return a list of the regressions: [(profile, stage, old, new), ...]
+    """
+    regressions = []
+    for profile, stages in results.items():
+        for stage, r in stages.items():
+            try:
+                old = baseline[profile][stage]['best']
+            except KeyError:
+                continue
+            new = r.get('best')
+            if new == None:
+                regressions.append((profile, stage, old, None))
+            elif (new - old > _MINDIFF
+                    and new > old * (1 + tolerance / 100)):
+                regressions.append((profile, stage, old, new))
+    return regressions
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description="Zeitmessung der Zeugniserstellung mit"
+                    " synthetischen Schuldaten")
+    parser.add_argument('--pupils', type=int, nargs='+', default=_PUPILS,
+            help="Anzahl der Schüler (ganze Schule)")
+    parser.add_argument('--subjects', type=int, nargs='+',
+            default=_SUBJECTS, help="Anzahl der Fächer pro Klasse")
+    parser.add_argument('--repeat', type=int, default=_REPEAT)
+    parser.add_argument('--baseline', default=os.path.join(ZEUGS,
+            _BASELINE))
+    parser.add_argument('--save', action='store_true',
+            help="Ergebnisse als neue Vergleichsbasis speichern")
+    parser.add_argument('--tolerance', type=float, default=_TOLERANCE,
+            help="erlaubte Verlangsamung (Prozent)")
+    parser.add_argument('--keep', action='store_true',
+            help="erzeugte Daten nicht löschen")
+    args = parser.parse_args()
+
+    results = OrderedDict()
+    for npupils in args.pupils:
+        for nsubjects in args.subjects:
+            profile = profileName(npupils, nsubjects)
+            print("\n+++", profile)
+            try:
+                results[profile] = runProfile(npupils, nsubjects,
+                        args.repeat, args.keep)
+            except RuntimeError:
+                REPORT.printMessages()
+                quit(1)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as fh:
+            json.dump({'date': datetime.datetime.now().isoformat(
+                            timespec='seconds'),
+                    'python': sys.version.split()[0],
+                    'profiles': results}, fh, indent=2)
+        print("\nVergleichsbasis gespeichert:", args.baseline)
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline['profiles'], args.tolerance)
+        print("\nVergleich mit", args.baseline, "(%s)" % baseline['date'])
+        for profile, stage, old, new in regressions:
+            print("  LANGSAMER: %s %s: %.3f s ->" % (profile, stage, old),
+                    "FEHLER" if new == None else "%.3f s" % new)
+        if regressions:
+            quit(1)
+        print("  Keine Verschlechterung")
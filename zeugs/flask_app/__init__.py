@@ -31,12 +31,13 @@ Copyright 2019-2020 Michael Towers
 import os, sys, datetime
 
 from flask import (Flask, render_template, request, redirect, session,
-        send_from_directory, url_for, flash)
+        send_from_directory, url_for, flash, g)
 from flask_session import Session
 from flask_wtf.csrf import CSRFProtect
 csrf = CSRFProtect()
 
-from wz_core.configuration import init, Paths
+from wz_core.configuration import init
+from wz_core.timing import Timing
 
 ZEUGS_BASE = os.environ['ZEUGS_BASE']
 
@@ -62,7 +63,7 @@ def logger(messages, suppressok):
     toflash = []
     for mi, mt, msg in messages:
         if mi > 9:
-            msg = "Unerwarter Programmfehler: siehe Log-Datei %s" % l
+            msg = "Unerwarter Programmfehler: siehe Log, Eintrag %s" % l
         elif mi > mimax:
             mimax = mi
         try:
@@ -72,7 +73,7 @@ def logger(messages, suppressok):
             mimax = 10
         toflash.append ((etype + '::: ' + msg, mt))
     if len(toflash) > 10:
-        flash("Abgekürzt: für alle Meldungen, siehe Log-Datei %s. ..." % l)
+        flash("Abgekürzt: für alle Meldungen, siehe Log, Eintrag %s. ..." % l)
         toflash = toflash[-9:]
     for msg in toflash:
         flash(*msg)
@@ -83,7 +84,7 @@ def logger(messages, suppressok):
         flash("*** Aktion mit Warnung(en) abgeschlossen ...", "Warning")
     elif not suppressok:
         flash("+++ Aktion erfolgreich abgeschlossen ...", "Info")
-    return Paths.logfile(l)
+    return l
 
 ZEUGS_DATA = init(None, xlog=logger)
 
@@ -127,6 +128,9 @@ def create_app(test_config=None):
     # view (see grades/grades.py:download()).
 
     Session(app)
+    # Remove old session files in a background thread
+    from .session_janitor import SessionJanitor
+    SessionJanitor.startFor(app)
 #    for k,v in app.config.items():
 #        print ("§§§ %s:" % k, v)
 
@@ -139,6 +143,22 @@ def create_app(test_config=None):
     from .auth import auth
     app.register_blueprint(auth.bp, url_prefix='/auth')
 
+    @app.before_request
+    def report_scope():
+        """Collect the messages of each request separately, so that
+        concurrent requests don't pick up each other's messages.
+        Also the timing breakdown (if enabled) is per request.
+        """
+        g.report_token = REPORT.beginScope()
+        g.timing_token = Timing.begin()
+
+    @app.teardown_request
+    def report_scope_end(exc):
+        token = g.pop('report_token', None)
+        if token:
+            REPORT.endScope(token)
+        Timing.record(request.path, Timing.end(g.pop('timing_token', None)))
+
     @app.before_request
     def check_access():
         """Handle access to pages which require authentication.
@@ -244,4 +264,7 @@ def create_app(test_config=None):
     from .grades import grades
     app.register_blueprint(grades.bp, url_prefix='/grade_report')
 
+    from .jobs import jobs
+    app.register_blueprint(jobs.bp, url_prefix='/jobs')
+
     return app
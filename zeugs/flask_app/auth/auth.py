@@ -29,7 +29,7 @@ Copyright 2019-2020 Michael Towers
 
 #TODO: Check imports
 
-import os, time
+import os, threading
 
 from flask import (Blueprint, g, redirect, render_template, request,
         session, url_for, current_app
@@ -41,13 +41,29 @@ from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, StopValidation
 
 from wz_table.dbtable import dbTable
+from wz_table.spreadsheet import Spreadsheet
 from wz_core.configuration import Paths
 
 
 class Users:
+    """Access to the user table (file USERS in the instance folder).
+    The table is shared by all instances and only read again when the
+    file has changed, so checking a login doesn't parse the spreadsheet.
+    """
+    # The user data: (file stamp, {tid -> {field -> value}})
+    _cache = None
+    _lock = threading.Lock()
+
     def __init__(self):
-        self.udb = dbTable(current_app.config['USERS'],
-                translate = CONF.TABLES.TEACHER_FIELDNAMES)
+        filepath = current_app.config['USERS']
+        stamp = Spreadsheet.fileStamp(filepath)
+        with self._lock:
+            cache = Users._cache
+            if cache == None or cache[0] != stamp:
+                cache = (stamp, dbTable(filepath,
+                        translate = CONF.TABLES.TEACHER_FIELDNAMES))
+                Users._cache = cache
+        self.udb = cache[1]
 
     def valid(self, tid):
         return tid in self.udb
@@ -102,15 +118,8 @@ def login():
         # Set the school-year to the latest one:
         session['year'] = Paths.getYears()[0]
         session.permanent = True
-
-        # Delete old session files
-        sdir = current_app.config['SESSION_FILE_DIR']
-        now = time.time()
-        for f in os.listdir(sdir):
-            ff = os.path.join(sdir, f)
-            delta = (now - os.path.getmtime(ff))/86400
-            if delta > 2:
-                os.remove(ff)
+        # Old session files are removed in the background, see
+        # <flask_app.session_janitor>.
 
     if session.get('user_id'):
         return redirect(url_for('index'))
@@ -37,7 +37,7 @@ _KLASS_AND_STREAM = ("Klasse {klass} kommt in GRADES/REPORT_CLASSES sowohl"
 _NO_CLASSES = "Keine Klassen für Halbjahr {term} [in wz_compat/grade_classes.py]"
 
 
-import datetime, io, os
+import datetime, os
 
 from flask import (Blueprint, render_template, request, session,
         send_file, url_for, abort, redirect, flash, make_response)
@@ -52,11 +52,13 @@ from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wz_core.configuration import Dates
 from wz_core.pupils import Pupils, Klass
 from wz_core.db import DB
+from wz_core.downloads import Downloads
 from wz_grades.gradedata import (readGradeTable, grades2db, db2grades,
         getGradeData, GradeReportData, singleGrades2db)
-from wz_grades.makereports import makeReports, makeOneSheet
+from wz_grades.makereports import makeReports, makeAllReports, makeOneSheet
 from wz_compat.grade_classes import gradeGroups
 from wz_compat.gradefunctions import gradeCalc
+from flask_app.jobs.jobs import submit
 
 
 # Set up Blueprint
@@ -118,11 +120,11 @@ def klassview(termn, klass_stream):
         _d = form.DATE_D.data.isoformat()
         pids=request.form.getlist('Pupil')
         if pids:
-            pdfBytes = REPORT.wrap(makeReports,
-                    schoolyear, termn, klass, _d, pids)
-            session['filebytes'] = pdfBytes
-            session['download'] = 'Notenzeugnis_%s.pdf' % klass
-            return redirect(url_for('bp_grades.term', termn=termn))
+            # Build the reports in the background
+            return submit(url_for('bp_grades.term', termn=termn),
+                    "Notenzeugnisse %s" % klass,
+                    'Notenzeugnis_%s.pdf' % klass,
+                    makeReports, schoolyear, termn, klass, _d, pids)
         else:
             flash("** Keine Schüler ... **", "Warning")
 
@@ -144,6 +146,39 @@ def klassview(termn, klass_stream):
 # with all boxes unchecked?
 
 
+### Select date-of-issue and generate reports for all groups of a term.
+@bp.route('/all/<termn>', methods=['GET','POST'])
+def allview(termn):
+    """View: Handle report generation for all groups of the given term.
+    The result is a zip-file with a pdf-file for each group.
+    """
+    class _Form(FlaskForm):
+        DATE_D = DateField('Ausgabedatum', validators=[InputRequired()])
+
+    schoolyear = session['year']
+    form = _Form()
+    if form.validate_on_submit():
+        # POST
+        _d = form.DATE_D.data.isoformat()
+        # Build the reports in the background
+        return submit(url_for('bp_grades.term', termn=termn),
+                "Notenzeugnisse %s. Halbjahr" % termn,
+                'Notenzeugnisse_%s_%s.zip' % (schoolyear, termn),
+                makeAllReports, schoolyear, termn, _d)
+
+    # GET
+    form.DATE_D.data = datetime.date.today ()
+    klasses = REPORT.wrap(gradeGroups, termn, suppressok=True)
+    if not klasses:
+        flash(_NO_CLASSES.format(term = termn), "Error")
+        return redirect(url_for('bp_grades.index'))
+    return render_template(os.path.join(_BPNAME, 'all.html'),
+                            form=form,
+                            heading=_HEADING,
+                            termn=termn,
+                            klasses=klasses)
+
+
 ### Upload a grade table for a group (for the selected term).
 @bp.route('/upload/<termn>', methods=['GET','POST'])
 def addgrades(termn):
@@ -185,7 +220,7 @@ def klasses():
     # Accept all classes here, then – when it turns out that the class
     # has no possible templates – show a message indicating this state
     # of affairs.
-    pupils = Pupils(schoolyear)
+    pupils = Pupils(schoolyear, readonly=True)
     # List the classes with the oldest pupils first, as these are more
     # likely to need grades.
     klasslist = sorted(pupils.classes(), reverse=True)
@@ -205,7 +240,7 @@ def pupils(klass):
         dfile = None
     schoolyear = session['year']
     # Collect list of pupils for this school-class.
-    pupils = Pupils(schoolyear)
+    pupils = Pupils(schoolyear, readonly=True)
     # List the classes with the highest first, as these are more
     # likely to need grades.
     _klass = Klass(klass)
@@ -239,12 +274,12 @@ def pupil(pid):
 
     schoolyear = session['year']
     # Get pupil data
-    pupils = Pupils(schoolyear)
+    pupils = Pupils(schoolyear, readonly=True)
     pdata = pupils.pupil(pid)
     pname = pdata.name()
     klass = pdata.getKlass(withStream=True)
     # Get existing dates.
-    db = DB(schoolyear)
+    db = DB(schoolyear, 'READONLY')
     rows = db.select('GRADES', PID=pid)
     dates = [_NEWDATE]
     for row in db.select('GRADES', PID=pid):
@@ -416,9 +451,11 @@ def make1(pid, rtype, rtag, kname):
         if REPORT.wrap(enterGrades, suppressok=True):
             pdfBytes = REPORT.wrap(makeOneSheet,
                     schoolyear, DATE_D, pdata, rtag, rtype)
-            session['filebytes'] = pdfBytes
-            session['download'] = 'Notenzeugnis_%s.pdf' % (
-                    pdata['PSORT'].replace(' ', '_'))
+            if pdfBytes:
+                # Only a token for the stored file is kept in the session
+                session['filetoken'] = Downloads.store(pdfBytes)
+                session['download'] = 'Notenzeugnis_%s.pdf' % (
+                        pdata['PSORT'].replace(' ', '_'))
             return redirect(url_for('bp_grades.pupils', klass = klass.klass))
 
 #TODO: ?
@@ -449,17 +486,16 @@ def make1(pid, rtype, rtag, kname):
 @bp.route('/download/<dfile>', methods=['GET'])
 def download(dfile):
     """Handle downloading of generated files.
-    The files are not stored permanently. Only one is available (per
-    session) and when it has been downloaded – or just clicked on – it
-    will be removed.
+    The files are not stored permanently (see <Downloads>). Only one is
+    available (per session) and when it has been downloaded – or just
+    clicked on – it will no longer be accessible via the session.
     """
-    try:
-        pdfBytes = session.pop('filebytes')
-    except:
+    path = Downloads.path(session.pop('filetoken', None))
+    if not path:
         flash("Die Datei '%s' steht nicht mehr zur Verfügung" % dfile, "Warning")
         return redirect(request.referrer)
     response = make_response(send_file(
-        io.BytesIO(pdfBytes),
+        path,
         attachment_filename=dfile,
         mimetype='application/pdf',
         as_attachment=True
@@ -0,0 +1,118 @@
+### python >= 3.7
+# -*- coding: utf-8 -*-
+
+"""
+flask_app/jobs/jobs.py
+
+Last updated:  2020-02-05
+
+Flask Blueprint for background jobs: progress display and download of
+the results.
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+import os, mimetypes
+from urllib.parse import urlsplit
+
+from flask import (Blueprint, render_template, request, session,
+        send_file, url_for, abort, redirect, flash)
+
+from wz_core.jobs import Jobs, JOB_DONE, JOB_FAILED
+from wz_core.timing import Timing
+
+
+# Set up Blueprint
+_BPNAME = 'bp_jobs'
+bp = Blueprint(_BPNAME,             # internal name of the Blueprint
+        __name__)                   # allows the current package to be found
+
+
+def submit(back, title, filename, f, *args, **kargs):
+    """Start a background job (see <Jobs.submit>) for the current user
+    and redirect to the page showing its progress.
+    <back> is the url of the page to return to.
+    """
+    jobid = Jobs.submit(session.get('user_id'), title, filename,
+            f, *args, **kargs)
+    return redirect(url_for('bp_jobs.status', jobid=jobid, back=back))
+
+
+def _localUrl(url):
+    """Return <url> if it is a path within this site, otherwise <None>.
+    Protocol-relative urls ("//host/...", also "/\\host/...", which
+    browsers treat in the same way) lead to other sites. Browsers also
+    ignore tabs and line breaks in urls, so these are not accepted.
+    """
+    if any(c in url for c in '\t\r\n'):
+        return None
+    if url.startswith('/') and not url.startswith(('//', '/\\')):
+        parts = urlsplit(url)
+        if not (parts.scheme or parts.netloc):
+            return url
+    return None
+
+
+def _getJob(jobid):
+    job = Jobs.status(jobid)
+    if not job or job['OWNER'] != session.get('user_id'):
+        abort(404)
+    return job
+
+
+@bp.route('/status/<jobid>', methods=['GET'])
+def status(jobid):
+    """View: show the progress of a job. The page is reloaded regularly
+    until the job has finished. Then the messages from the job are shown
+    and – if successful – a download link for the result.
+    """
+    job = _getJob(jobid)
+    finished = job['STATUS'] in (JOB_DONE, JOB_FAILED)
+    if finished and (job['MESSAGES'] or job['TIMING']):
+        # Pass the messages on to the user (only once)
+        Jobs.clearMessages(jobid)
+        Timing.record(job['TITLE'], job['TIMING'])
+        for msg in job['MESSAGES']:
+            REPORT.out(*msg)
+        REPORT.printMessages(suppressok=True)
+    back = _localUrl(request.args.get('back', '')) or url_for('index')
+    return render_template(os.path.join(_BPNAME, 'status.html'),
+                            heading=job['TITLE'],
+                            job=job,
+                            finished=finished,
+                            uplink=back)
+
+
+@bp.route('/fetch/<jobid>', methods=['GET'])
+def fetch(jobid):
+    """View: download the result of a job.
+    """
+    job = _getJob(jobid)
+    path = Jobs.fetch(jobid)
+    if not path:
+        flash("Die Datei '%s' steht nicht mehr zur Verfügung"
+                % job['FILENAME'], "Warning")
+        return redirect(url_for('bp_jobs.status', jobid=jobid))
+    response = send_file(path,
+        attachment_filename=job['FILENAME'],
+        mimetype=mimetypes.guess_type(job['FILENAME'])[0],
+        as_attachment=True
+    )
+    # Prevent caching:
+    response.headers['Cache-Control'] = 'max-age=0'
+    return response
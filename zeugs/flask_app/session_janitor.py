@@ -0,0 +1,102 @@
+### python >= 3.7
+# -*- coding: utf-8 -*-
+
+"""
+flask_app/session_janitor.py
+
+Last updated:  2020-02-05
+
+Removal of old session files (Flask-Session, "filesystem" type), in a
+background thread, so that the requests don't need to wait for it.
+
+The folder is scanned every <interval> seconds (configuration item
+SESSION_JANITOR_INTERVAL), files which have not been modified for
+<maxage> seconds (SESSION_JANITOR_MAXAGE) are removed. Several server
+processes may each run a janitor, a file which has already been
+removed by another one is simply skipped.
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+_MAXAGE = 2 * 86400     # default age (seconds) at which a file is removed
+_INTERVAL = 3600        # default time (seconds) between scans
+# Files of the cache itself (not sessions) begin with:
+_CACHE_FILES = '__wz_cache'
+
+import os, time, threading
+
+
+class SessionJanitor(threading.Thread):
+    _lock = threading.Lock()
+    _running = None
+
+    @classmethod
+    def startFor(cls, app):
+        """Start the janitor for the session folder of the flask <app>,
+        unless one is already running in this process.
+        """
+        with cls._lock:
+            if cls._running == None:
+                cls._running = cls(app.config['SESSION_FILE_DIR'],
+                        app.config.get('SESSION_JANITOR_MAXAGE', _MAXAGE),
+                        app.config.get('SESSION_JANITOR_INTERVAL',
+                                _INTERVAL))
+                cls._running.start()
+            return cls._running
+
+
+    def __init__(self, folder, maxage, interval):
+        super().__init__(name='session-janitor', daemon=True)
+        self.folder = folder
+        self.maxage = maxage
+        self.interval = interval
+        self._stopped = threading.Event()
+
+
+    def run(self):
+        while True:
+            try:
+                self.sweep()
+            except OSError:
+                # e.g. the folder doesn't exist (yet), try again later
+                pass
+            if self._stopped.wait(self.interval):
+                return
+
+
+    def stop(self):
+        self._stopped.set()
+
+
+    def sweep(self):
+        """Remove the old session files. Return the number removed.
+        """
+        tmin = time.time() - self.maxage
+        n = 0
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.startswith(_CACHE_FILES):
+                    continue
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < tmin:
+                        os.remove(entry.path)
+                        n += 1
+                except FileNotFoundError:
+                    # Removed by another process
+                    pass
+        return n
@@ -35,10 +35,11 @@ from wtforms import BooleanField, SelectField
 #from wtforms.fields.html5 import DateField
 #from wtforms.validators import InputRequired, Length
 
-import os
+import os, datetime
 #from types import SimpleNamespace
 
 from wz_core.configuration import Paths
+from wz_core.timing import Timing
 #from wz_core.db import DB
 #from wz_core.pupils import Pupils, match_klass_stream
 #from wz_compat.config import sortingName
@@ -77,6 +78,25 @@ def index():
                             heading=_HEADING)
 
 
+@bp.route('/timing', methods=['GET'])
+#@admin_required
+def timing():
+    """View: the timing breakdowns of the latest requests and jobs, and
+    the totals for all stages (see <wz_core.timing>).
+    """
+    recent = [(datetime.datetime.fromtimestamp(t).isoformat(
+                    sep=' ', timespec='seconds'),
+                label, seconds,
+                sorted(breakdown.items(), key=lambda item: item[1][1],
+                        reverse=True))
+            for t, label, seconds, breakdown in Timing.recent()]
+    return render_template(os.path.join(_BPNAME, 'timing.html'),
+                            heading=_HEADING,
+                            enabled=Timing.isEnabled(),
+                            recent=recent,
+                            totals=Timing.totals())
+
+
 @bp.route('/newyear', methods=['GET','POST'])
 #@admin_required
 def newyear():
@@ -28,7 +28,7 @@ Copyright 2019 Michael Towers
 
 #TODO ...
 
-from flask import (Blueprint, render_template, request, send_file,
+from flask import (Blueprint, render_template, request,
         session, url_for)
 from flask import current_app as app
 
@@ -37,13 +37,14 @@ from wtforms import RadioField
 from wtforms.fields.html5 import DateField
 from wtforms.validators import InputRequired
 
-import os, datetime, io
+import os, datetime
 #from types import SimpleNamespace
 
 from wz_core.configuration import Dates
 #from wz_text.checksubjects import makeSheets as tSheets
 from wz_text.summary import tSheets, ksSheets
 #from wz_text.print_klass_subject_teacher import makeSheets as ksSheets
+from flask_app.jobs.jobs import submit
 
 # Filenames for downloading
 _TEACHER_TABLE = 'Lehrer-Klasse-Tabelle'
@@ -94,25 +95,17 @@ def summary():
     form = RadioForm()
     if form.validate_on_submit():
         # POST
+        # Build the tables in the background
         if form.choice.data == 'teachers':
-            pdfBytes = tSheets(session['year'],
-                            getManager()['name'],
-                            Dates.today())
-            filename = _TEACHER_TABLE
+            return submit(url_for('bp_text.summary'), _TEACHER_TABLE,
+                    _TEACHER_TABLE + '.pdf',
+                    tSheets, session['year'], getManager()['name'],
+                    Dates.today())
         elif form.choice.data == 'classes':
-            pdfBytes = ksSheets(session['year'],
-                            getManager()['name'],
-                            Dates.today())
-            filename = _KLASS_TABLE
-        else:
-            pdfBytes = None
-        if pdfBytes:
-            return send_file(
-                io.BytesIO(pdfBytes),
-                attachment_filename=filename + '.pdf',
-                mimetype='application/pdf',
-                as_attachment=True
-            )
+            return submit(url_for('bp_text.summary'), _KLASS_TABLE,
+                    _KLASS_TABLE + '.pdf',
+                    ksSheets, session['year'], getManager()['name'],
+                    Dates.today())
     # GET
     return render_template(os.path.join(_BPNAME, 'summary.html'),
                             form=form,
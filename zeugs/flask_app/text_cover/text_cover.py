@@ -44,6 +44,7 @@ from wz_core.pupils import Pupils, Klass
 from wz_compat.config import sortingName
 from wz_compat.template import getTextTemplate, getTemplateTags, pupilFields
 from wz_text.coversheet import makeSheets, makeOneSheet
+from flask_app.jobs.jobs import submit
 
 _HEADING = "Textzeugnis"
 
@@ -55,7 +56,7 @@ class DateForm(FlaskForm):
         return self.DATE_D.data.isoformat()
 
     def defaultIssueDate(self, schoolyear):
-        db = DB(schoolyear)
+        db = DB(schoolyear, 'READONLY')
         _date = db.getInfo('TEXT_DATE_OF_ISSUE')
         if not _date:
             _date = Dates.getCalendar(schoolyear).get('END')
@@ -86,7 +87,7 @@ def index():
 
     # GET
     form.defaultIssueDate(schoolyear)
-    p = Pupils(schoolyear)
+    p = Pupils(schoolyear, readonly=True)
     _kmap = CONF.TEXT.REPORT_TEMPLATES['Mantelbogen']
     klasses = []
     for k in p.classes():
@@ -111,17 +112,16 @@ def klassview(klass):
         _d = form.getDate()
         pids = request.form.getlist('Pupil')
         if pids:
-            pdfBytes = makeSheets(schoolyear, _d, _klass, pids=pids)
-            return send_file(io.BytesIO(pdfBytes),
-                attachment_filename = 'Mantel_%s.pdf' % _klass,
-                mimetype = 'application/pdf',
-                as_attachment = True
-            )
+            # Build the cover sheets in the background
+            return submit(url_for('bp_text_cover.klassview', klass=klass),
+                    "Mantelbögen %s" % _klass,
+                    'Mantel_%s.pdf' % _klass,
+                    makeSheets, schoolyear, _d, _klass, pids=pids)
         flash("Keine Schüler gewählt", "Warning")
 
     # GET
     form.defaultIssueDate(schoolyear)
-    p = Pupils(schoolyear)
+    p = Pupils(schoolyear, readonly=True)
     pdlist = p.classPupils(_klass)
     return render_template(os.path.join(_BPNAME, 'text_cover_klass.html'),
                             form = form,
@@ -160,7 +160,7 @@ def pupilview(klass, pid):
         )
     # GET
     form.defaultIssueDate(schoolyear)
-    p = Pupils(schoolyear)
+    p = Pupils(schoolyear, readonly=True)
     try:
         pdlist = p.classPupils(_klass)
         pdata = pdlist.pidmap[pid]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+make_reports.py
+
+Last updated:  2020-02-05
+
+Build the grade reports for all groups of a term (see
+<wz_grades.makereports.makeAllReports>) and save them as a zip-file.
+
+Usage:
+    make_reports.py [--timing] <school-year> <term> <date of issue> [<zip-file>]
+
+With --timing a breakdown of the time spent in the various stages is
+printed (see <wz_core.timing>).
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+import argparse
+
+from test_core import testinit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description="Notenzeugnisse für alle Klassen/Gruppen erstellen")
+    parser.add_argument('schoolyear', type=int)
+    parser.add_argument('term')
+    parser.add_argument('date', help="Ausgabedatum, YYYY-MM-DD")
+    parser.add_argument('zipfile', nargs='?')
+    parser.add_argument('--timing', action='store_true',
+            help="Zeitmessung der einzelnen Schritte ausgeben")
+    args = parser.parse_args()
+
+    testinit ()
+
+    from wz_core.timing import Timing
+    from wz_grades.makereports import makeAllReports
+    if args.timing:
+        Timing.enabled = True
+    timing = Timing.begin()
+    zbytes = REPORT.wrap(makeAllReports, args.schoolyear, args.term,
+            args.date)
+    timing = Timing.end(timing)
+    if timing:
+        print(Timing.format("makeAllReports", timing))
+    if zbytes:
+        fpath = args.zipfile or 'Notenzeugnisse_%s_%s.zip' % (
+                args.schoolyear, args.term)
+        with open(fpath, 'wb') as fh:
+            fh.write(zbytes)
+        print(" -->", fpath)
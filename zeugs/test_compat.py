@@ -23,5 +23,8 @@ if __name__ == '__main__':
     from wz_compat import config
     runTests (config)
 
+    from wz_compat import template
+    runTests (template)
+
     from wz_compat import grades
     runTests (grades)
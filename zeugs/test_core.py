@@ -58,9 +58,24 @@ def runTests (module):
 if __name__ == '__main__':
     testinit ()
 
+    from wz_core import reporting
+    runTests (reporting)
+
+    from wz_core import timing
+    runTests (timing)
+
     from wz_core import configuration
     runTests (configuration)
 
+    from wz_core import db
+    runTests (db)
+
+    from wz_core import downloads
+    runTests (downloads)
+
+    from wz_core import jobs
+    runTests (jobs)
+
     from wz_core import pupils
     runTests (pupils)
 
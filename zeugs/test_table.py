@@ -0,0 +1,36 @@
+#!../venv/bin/python
+# -*- coding: utf-8 -*-
+"""
+test_table.py
+
+Last updated:  2020-03-20
+
+Run some tests on the modules in the wz_table package.
+
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+from test_core import testinit, runTests
+
+
+if __name__ == '__main__':
+    testinit ()
+
+    from wz_table import spreadsheet
+    runTests (spreadsheet)
@@ -59,7 +59,7 @@ from collections import OrderedDict, UserDict
 from glob import glob
 
 from wz_core.configuration import Dates, Paths
-from wz_core.db import DB
+from wz_core.db import DB, PUPILS_KEYS
 # To read/write spreadsheet tables:
 from wz_table.dbtable import readDBTable, makeDBTable
 
@@ -394,9 +394,12 @@ def updateFromRaw (schoolyear, rawdata):
     db.deleteTable ('OLDPUPILS')
     if db.tableExists ('PUPILS'):
         db.renameTable ('PUPILS', 'OLDPUPILS')
+        # The index names would clash with those of the new table
+        db.deleteIndexes ('OLDPUPILS')
     db.renameTable ('NEWPUPILS', 'PUPILS')
     db.deleteIndexes ('PUPILS')
     db.makeIndexes ('PUPILS', indexes)
+    db.makeIndexes ('PUPILS', PUPILS_KEYS, unique=False)
 
 
 
@@ -446,7 +449,7 @@ def importPupils (schoolyear, filepath):
     # This makes quite a small db (without rowid).
     db.makeTable2 ('PUPILS', fields, data=rows,
             force=True,
-            pk=('CLASS', 'PSORT'), index=('PID',))
+            pk=('CLASS', 'PSORT'), index=('PID',), keys=PUPILS_KEYS)
 
     return classes
 
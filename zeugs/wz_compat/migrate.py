@@ -28,8 +28,8 @@ _BADCLASSNAME = "Ungültiger Klassenname: {klass}"
 _PUPIL_LEFT = "Abgemeldeter Schüler in Klasse {klass}: {name}"
 
 
-from wz_core.db import DB
-from wz_core.pupils import Pupils, PupilData
+from wz_core.db import DB, PUPILS_KEYS
+from wz_core.pupils import Pupils, PupilData, Klass
 
 ## First (official) day of school year
 #    month1 = CONF.MISC.SCHOOLYEAR_MONTH_1.nat (1, 12)
@@ -60,7 +60,7 @@ def migratePupils (schoolyear):
         except:
             REPORT.Fail (_BADCLASSNAME, klass=c_old)
         c_new = '%02d%s' % (cnum, ctag)
-        for prow in pdb.classPupils (c_old):
+        for prow in pdb.classPupils (Klass (c_old)):
             left = False
             if prow ['EXIT_D']:
                 # If there is an exit date, assume the pupil has left.
@@ -87,7 +87,7 @@ def migratePupils (schoolyear):
     # This makes quite a small db (without rowid).
     db.makeTable2 ('PUPILS', PupilData.fields (), data=rows,
             force=True,
-            pk=('CLASS', 'PSORT'), index=('PID',))
+            pk=('CLASS', 'PSORT'), index=('PID',), keys=PUPILS_KEYS)
 
 
 
@@ -41,30 +41,30 @@ def readSPTable (filepath):
     rows = []
 
     headers = None
-    for rowix in range (sheet.colLen ()):
+    # Read the rows one by one, without loading the whole table
+    for row in sheet.iterRows ():
         # Get the value in the first column
-        entry1 = sheet.getValue (rowix, 0)
-        if not entry1:
+        if not (row and row [0]):
             continue
         if headers == None:
             # Read the column headers from this line
             headers = {}
-            for cellix in range (sheet.rowLen ()):
-                h = sheet.getValue (rowix, cellix)
+            for cellix, h in enumerate (row):
                 if h:
                     headers [h] = cellix
                 else:
                     REPORT.Fail (_NOHEADER, col=cellix+1, path=filepath)
+            Row = namedtuple ('Row', headers)
             continue
-        Row = namedtuple ('Row', headers)
         ### Read the row data
         rowdata = []
         for col in headers.values ():
             try:
-                rowdata.append (sheet.getValue (rowix, col))
+                rowdata.append (row [col])
             except:
                 rowdata.append (None)
         rows.append (Row (*rowdata))
+    sheet.close ()
     return rows
 
 
@@ -27,15 +27,18 @@ Copyright 2019-2020 Michael Towers
 =-LICENCE========================================
 """
 
+_BYTECODE_FOLDER = 'jinja'  # subfolder of DIR_CACHE for compiled templates
+
 # Messages
 _NO_TEMPLATE = "Vorlage nicht gefunden: {fname}"
 
 
-import os, re
+import os, re, threading
 
 import jinja2
 
 from wz_core.configuration import Paths, Dates
+from wz_core.timing import timed
 
 
 def getGradeTemplate(rtype, klass):
@@ -69,6 +72,36 @@ def getTextTemplate(rtype, klass):
 
 ##### Jinja template handling #####
 
+# The jinja environments are shared, one for each template folder, so
+# that the compiled templates are cached: {folder -> <Environment>}.
+# Changed template files are recompiled automatically (jinja checks the
+# modification time).
+_environments = {}
+_envLock = threading.Lock()
+
+def templateEnvironment(tpdir):
+    """Return the (shared) jinja2 <Environment> for the template folder
+    <tpdir>. The compiled templates are also saved in the folder
+    DIR_CACHE, so that they are available to new processes.
+    """
+    with _envLock:
+        try:
+            return _environments[tpdir]
+        except KeyError:
+            pass
+        bcdir = os.path.join(Paths.getUserPath('DIR_CACHE'),
+                _BYTECODE_FOLDER)
+        if not os.path.isdir(bcdir):
+            os.makedirs(bcdir)
+        env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(searchpath=tpdir),
+                bytecode_cache=jinja2.FileSystemBytecodeCache(bcdir),
+                autoescape=True)
+        _environments[tpdir] = env
+        return env
+
+
+@timed('template.load')
 def openTemplate(tpath):
     """Return a jinja2 <Template> instance.
     <tpath> is the path (folder separator '/') to the template file,
@@ -80,29 +113,41 @@ def openTemplate(tpath):
     tpdir = Paths.getUserPath('DIR_TEMPLATES')
     if tpsplit:
         tpdir = os.path.join(tpdir, *tpsplit)
-    templateLoader = jinja2.FileSystemLoader(searchpath=tpdir)
-    templateEnv = jinja2.Environment(loader=templateLoader, autoescape=True)
     try:
-        return templateEnv.get_template(fname)
+        return templateEnvironment(tpdir).get_template(fname)
     except:
         REPORT.Fail(_NO_TEMPLATE, fname=os.path.join(tpdir, fname))
 
 
+# The tags found in the template files:
+# {file path -> (modification time, <set> of tags)}
+_templateTags = {}
+
 def getTemplateTags(template):
     """Find all substrings containing only letters, digits, underscore
     and dot which are surrounded by '{{ ... }}' or '{% ... %}'.
     Each item must start with a letter or underscore. More than one such
     substring may occur in each block.
+    The result is cached for each file (until it is modified).
     Return a <set>.
     """
+    fpath = template.filename
+    mtime = os.stat(fpath).st_mtime_ns
+    try:
+        mt, tags = _templateTags[fpath]
+        if mt == mtime:
+            return set(tags)
+    except KeyError:
+        pass
     _match = r'([a-zA-Z_][a-zA-Z0-9_.]*)'
-    with open(template.filename, 'r', encoding='utf-8') as fh:
+    with open(fpath, 'r', encoding='utf-8') as fh:
         text = fh.read()
     tags = set()
     for item in re.findall(r'\{\{(.*?)\}\}', text):
         tags.update(re.findall(_match, item))
     for item in re.findall(r'\{\%(.*?)\%\}', text):
         tags.update(re.findall(_match, item))
+    _templateTags[fpath] = (mtime, frozenset(tags))
     return tags
 
 
@@ -130,4 +175,11 @@ def pupilFields(tags):
 
 ##################### Test functions
 def test_01 ():
-    return
+    t1 = openTemplate('Notenzeugnis/Notenzeugnis-SI.html')
+    t2 = openTemplate('Notenzeugnis/Notenzeugnis-SI.html')
+    if t1.environment is not t2.environment:
+        REPORT.Fail("Template environment not shared")
+    tags = getTemplateTags(t1)
+    if getTemplateTags(t2) != tags:
+        REPORT.Fail("Cached template tags differ")
+    REPORT.Test("Pupil fields: %s" % repr(pupilFields(tags)))
@@ -56,7 +56,7 @@ from collections import OrderedDict
 import datetime
 import builtins
 
-from .reporting import Report
+from .reporting import Report, LogSink
 
 
 def init (userFolder, logfile=None, xlog=None):
@@ -72,6 +72,9 @@ def init (userFolder, logfile=None, xlog=None):
         REPORT.logfile = logfile
     if xlog:
         REPORT.getLogfile = xlog
+        n = CONF.MISC.get('MAXLOGFILES')
+        REPORT.logSink = LogSink(Paths.getUserPath('DIR_LOGS'),
+                maxfiles=n.nat() if n else 2)
     return userFolder
 
 
@@ -378,22 +381,6 @@ class Paths:
                 reverse=True)
 
 
-    @classmethod
-    def logfile(cls, tag):
-        """Return a user- and time-based log-file path.
-        Excess old log files for the given user are deleted.
-        """
-        folder = cls.getUserPath('DIR_LOGS')
-        user = tag.rsplit('-', 1)[1]
-        files = sorted(glob.glob(os.path.join(folder, '*-%s.log' % user)),
-                reverse=True)
-        # Delete excess old log files for this user
-        nmax = CONF.MISC.MAXLOGFILES.nat()
-        while len(files) > nmax:
-            os.remove(files.pop())
-        return os.path.join(folder, tag + '.log')
-
-
 
 class Dates:
     @classmethod
@@ -115,8 +115,10 @@ from collections import OrderedDict, UserList
 from .configuration import Paths
 from .pupils import Pupils, Klass
 from .teachers import TeacherData
+from .timing import timed
 # To read subject table:
 from wz_table.dbtable import readDBTable
+from wz_table.spreadsheet import Spreadsheet
 # To (re)write class-course matrix
 from wz_table.formattedmatrix import FormattedMatrix
 
@@ -147,6 +149,12 @@ class TeacherList(list):
 
 _CLASSESCOL = 3 # First column with class-info
 class CourseTables:
+    # The parsed subject tables are cached, keyed by school-year. As the
+    # instances are only read, the cached data can be shared:
+    #   {schoolyear -> (file stamp, <_names>, <_classes>)}
+    _cache = {}
+
+    @timed('courses.read')
     def __init__ (self, schoolyear):
         """Read the subject table for the year.
         The first column is the subject id, the second the subject name.
@@ -163,10 +171,18 @@ class CourseTables:
         <self._classses>: {class -> {[ordered] sid -> <TeacherList> instance}
         In the latter there are only entries for non-empty cells (the
         teacher list may, however, be empty).
+        The table is only read again if the file has changed.
         """
         self.schoolyear = schoolyear
         self.teacherData = TeacherData (schoolyear)
         fpath = Paths.getYearPath (schoolyear, 'FILE_SUBJECTS')
+        stamp = Spreadsheet.fileStamp (fpath)
+        try:
+            _stamp, self._names, self._classes = self._cache [schoolyear]
+            if _stamp == stamp:
+                return
+        except KeyError:
+            pass
         data = readDBTable (fpath)
         # The class entries are in the columns after that with '#' as header.
         classes = {}            # {class -> table column}
@@ -194,6 +210,7 @@ class CourseTables:
                         self._classes [klass] [sid] = tlist
                     except:
                         self._classes [klass] = OrderedDict ([(sid, tlist)])
+        self._cache [schoolyear] = (stamp, self._names, self._classes)
 
 
     def classes (self):
@@ -275,3 +292,11 @@ def test_01 ():
     for sid, sinfo in ctables.filterText (Klass(klass)).items ():
         REPORT.Test ("  ++ %s (%s): %s" % (ctables.subjectName (sid),
                 sid, sinfo))
+
+def test_02 ():
+    ctables1 = CourseTables (_testyear)
+    ctables2 = CourseTables (_testyear)
+    if ctables1._classes is not ctables2._classes:
+        REPORT.Fail ("Subject table read twice")
+    REPORT.Test ("Subject table cached: %s" % repr (CourseTables._cache
+            [_testyear] [0]))
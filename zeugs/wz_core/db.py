@@ -49,23 +49,171 @@ GRADE_FIELDS = ('KLASS', 'STREAM', 'PID', 'TERM', 'REPORT_TYPE',
         'DATE_D', 'GRADES')
 GRADE_UNIQUE = [('PID', 'TERM')]
 
+### (Non-unique) indexes on the pupil table, to support the selection of
+# the pupils in a class, by stream and exit date (see
+# <wz_core.pupils.Pupils.classPupils>). The primary key is (CLASS, PSORT).
+PUPILS_KEYS = [('CLASS', 'STREAM', 'EXIT_D')]
 
-import os, sqlite3
-#from collections import OrderedDict #, namedtuple
+# Maximum number of values in a single "IN (...)" clause (sqlite has a
+# limit on the number of parameters in a statement)
+_MAXPARAMS = 500
+
+
+import os, sqlite3, threading, time
+from urllib.parse import quote
+from collections import OrderedDict #, namedtuple
 
 from .configuration import Paths
+from .timing import timed
+
+
+### Connection profile: the settings ("pragmas") applied to each new
+### connection.
+# With the "write-ahead log" readers are not blocked by a writer (and
+# vice versa). This setting is stored in the database file, so it is
+# not applied to read-only connections.
+# With the WAL, synchronous=NORMAL is safe (the database cannot be
+# corrupted), only the last transactions before a power failure may
+# be lost.
+# A negative cache_size is in KiB, mmap_size is in bytes.
+DB_JOURNAL_MODE = 'WAL'
+DB_PRAGMAS = (
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -8192),
+    ('mmap_size', 64*1024*1024),
+    ('busy_timeout', 5000),
+)
+
+def connect (filepath, readonly=False, **kargs):
+    """Open a connection to the given database file, applying the
+    connection profile (<DB_JOURNAL_MODE>, <DB_PRAGMAS>).
+    If <readonly> is true, the file is opened in read-only mode.
+    Further keyword arguments are passed to <sqlite3.connect>.
+    """
+    if readonly:
+        # The path must be quoted, as it is part of a URI
+        con = sqlite3.connect ('file:%s?mode=ro' % quote (filepath),
+                uri=True, **kargs)
+    else:
+        con = sqlite3.connect (filepath, **kargs)
+        if DB_JOURNAL_MODE:
+            con.execute ('PRAGMA journal_mode=%s' % DB_JOURNAL_MODE)
+    for pragma, value in DB_PRAGMAS:
+        con.execute ('PRAGMA %s=%s' % (pragma, value))
+    con.row_factory = sqlite3.Row
+#    con.row_factory = namedtuple_factory
+    return con
+
+
+
+class DBPool:
+    """A process-wide pool of sqlite connections, keyed by database file
+    and thread.
+    sqlite connections may not (safely) be shared between threads, so
+    each thread gets its own connection to a given database file. The
+    connections are opened with <check_same_thread=False> only so that
+    the pool can close them from another thread; they are never handed
+    to a thread other than the one in whose slot they are kept.
+    A connection is reopened when it is older than <MAXAGE> seconds.
+    When there are more than <MAXSIZE> connections in the pool, the least
+    recently used ones are evicted. An evicted connection is only dropped
+    from the pool – it is closed when no <DB0> instance refers to it any
+    more, so that a connection in use will not be closed "under the feet"
+    of its user.
+    The table check (<DB0._checkDB>) need only be done once for each file,
+    the files for which this has been done are remembered.
+    """
+    MAXAGE = 600    # seconds
+    MAXSIZE = 16
+    _lock = threading.Lock ()
+    # {(filepath, readonly, thread-id) -> (connection, time opened)},
+    # in order of use:
+    _connections = OrderedDict ()
+    _checked = set ()
+
+    @classmethod
+    def get (cls, filepath, readonly=False):
+        """Return a connection to the given database file for the current
+        thread, opening a new one if necessary.
+        If <readonly> is true, a read-only connection is returned.
+        Return a tuple: (connection, flag), where the flag is true if the
+        tables in the file still need to be checked.
+        """
+        key = (filepath, bool (readonly), threading.get_ident ())
+        now = time.monotonic ()
+        with cls._lock:
+            try:
+                con, t0 = cls._connections.pop (key)
+            except KeyError:
+                con = None
+            else:
+                if now - t0 > cls.MAXAGE:
+                    # Too old, the closing is left to the garbage collector
+                    # as it may still be in use.
+                    con = None
+            if con == None:
+                con = connect (filepath, readonly, check_same_thread=False)
+                t0 = now
+            # (Re)insert as most recently used entry
+            cls._connections [key] = (con, t0)
+            while len (cls._connections) > cls.MAXSIZE:
+                cls._connections.popitem (last=False)
+            return (con, filepath not in cls._checked)
+
+
+    @classmethod
+    def checked (cls, filepath):
+        """Note that the tables of the given file have been checked.
+        """
+        with cls._lock:
+            cls._checked.add (filepath)
+
+
+    @classmethod
+    def evict (cls, filepath=None):
+        """Remove the connections to the given file – or, if no file is
+        given, all connections – from the pool.
+        This must be done, for example, before a database file is removed.
+        """
+        with cls._lock:
+            for key in list (cls._connections):
+                if filepath == None or key [0] == filepath:
+                    del (cls._connections [key])
+            if filepath == None:
+                cls._checked.clear ()
+            else:
+                cls._checked.discard (filepath)
+
 
 
 class DB0:
     def __init__ (self, filepath, flag=None):
+        """Open the database file <filepath>.
+        <flag> determines the handling of the file:
+            <None>: the file must exist.
+            'READONLY': the file must exist, it is opened read-only (the
+                tables are not checked).
+            'NOREPORT': as <None>, but a missing file is reported by
+                raising a <RuntimeError>.
+            'CANCREATE': the file will be created if it doesn't exist.
+            'MUSTCREATE': the file must not exist, it will be created.
+            'RECREATE': an existing file will be removed, a new one
+                created.
+        """
+        self.readonly = flag == 'READONLY'
         if os.path.isfile (filepath):
             if flag == 'RECREATE':
-                # An existing file must be removed
+                # An existing file must be removed, together with any
+                # journal (write-ahead log) files.
+                self._release (filepath)
                 os.remove (filepath)
+                for x in '-wal', '-shm':
+                    if os.path.isfile (filepath + x):
+                        os.remove (filepath + x)
             elif flag == 'MUSTCREATE':
                 raise RuntimeError ("db-file exists already")
         else:
-            if flag == None:
+            if flag == None or self.readonly:
                 REPORT.Fail (_DBFILENOTFOUND, path=filepath)
             if flag == 'NOREPORT':
                 raise RuntimeError ("db-file not found")
@@ -75,10 +223,23 @@ class DB0:
                 os.makedirs (dbdir)
 
         self.filepath = filepath
-        self._dbcon = sqlite3.connect (filepath)
-        self._dbcon.row_factory = sqlite3.Row
-#        self._dbcon.row_factory = namedtuple_factory
-        self._checkDB ()
+        self._dbcon = self._connect (filepath)
+
+
+    def _connect (self, filepath):
+        """Open a new connection to the database file and check its tables.
+        """
+        con = connect (filepath, self.readonly)
+        if not self.readonly:
+            self._dbcon = con
+            self._checkDB ()
+        return con
+
+
+    def _release (self, filepath):
+        """Called before the database file is removed.
+        """
+        pass
 
 
     def close (self):
@@ -93,6 +254,9 @@ class DB0:
             self.makeTable2 ('INFO', ('K', 'V'), index=['K'])
         if not self.tableExists ('GRADES'):
             self.makeTable2 ('GRADES', GRADE_FIELDS, index=GRADE_UNIQUE)
+        if self.tableExists ('PUPILS'):
+            # Older databases may lack these indexes
+            self.makeIndexes ('PUPILS', PUPILS_KEYS, unique=False)
 #TODO ...
 
 
@@ -117,7 +281,8 @@ class DB0:
                         data)
 
 
-    def makeTable2 (self, name, fields, data=None, pk=None, index=None, force=False):
+    def makeTable2 (self, name, fields, data=None, pk=None, index=None,
+            force=False, keys=None):
         """Create the named table with the given fields and data.
         <fields> is a list of field names or (name, type) pairs. The
         default type is TEXT.
@@ -130,7 +295,9 @@ class DB0:
         which unique indexes are to be built.
         If <force> is true, an existing table will be overwritten and its
         indexes will be dropped.
-        The indexes are return as a list (one for each index) of lists
+        <keys> is a list of lists of columns for which non-unique indexes
+        are to be built (to speed up queries).
+        The unique indexes are return as a list (one for each index) of lists
         (one entry for each field).
         """
         ccreate = "CREATE TABLE {name} ({fields}{pk}){withoutrowid}"
@@ -188,19 +355,27 @@ class DB0:
                         data)
         if ixlist:
             self.makeIndexes (name, ixlist)
+        if keys:
+            self.makeIndexes (name, keys, unique=False)
         return ixlist
 
 
-    def makeIndexes (self, table, ixlist):
+    def makeIndexes (self, table, ixlist, unique=True):
         """Create one or more unique indexes on the given table.
         <ixlist> is a list of lists. Each unique index has a list of fields.
+        If <unique> is false, the indexes are not unique, they are only
+        created if they don't already exist.
         """
+        if unique:
+            cindex0 = 'CREATE UNIQUE INDEX idx_{name}_{n} ON {name} ({x})'
+        else:
+            cindex0 = ('CREATE INDEX IF NOT EXISTS key_{name}_{n}'
+                    ' ON {name} ({x})')
         with self._dbcon as con:
             n = 0
             for ix in ixlist:
                 n += 1
-                cindex = ('CREATE UNIQUE INDEX idx_{name}_{n}'
-                        ' ON {name} ({x})').format (
+                cindex = cindex0.format (
                                 n = n,
                                 name = table,
                                 x = ','.join (ix))
@@ -208,6 +383,7 @@ class DB0:
                 con.execute (cindex)
 
 
+    @timed('db.query')
     def getTable (self, table):
         with self._dbcon as con:
             cur = con.cursor ()
@@ -217,6 +393,7 @@ class DB0:
             return cur.fetchall ()
 
 
+    @timed('db.query')
     def selectDistinct (self, table, column, **criteria):
         """Select distinct values from a single column.
         The <criteria> may be of the form FIELDNAME=value.
@@ -238,6 +415,7 @@ class DB0:
             return [row [column] for row in cur.fetchall ()]
 
 
+    @timed('db.query')
     def select (self, table, order=None, reverse=False, **criteria):
         """Select all fields of the given table.
         The results may may ordered by specifying a list of fields to
@@ -267,6 +445,58 @@ class DB0:
             return cur.fetchall ()
 
 
+    @timed('db.query')
+    def selectWhere (self, table, condition, values, order=None):
+        """Select all fields of the given table for the records which
+        satisfy <condition>, an sql expression (the WHERE clause) with
+        '?' placeholders for the <values>. This allows conditions which
+        can't be expressed by the criteria of <select>.
+        The results may be ordered by specifying a list of fields to
+        <order>.
+        """
+        cmd = 'SELECT * FROM {} WHERE {}'.format (table, condition)
+        if order:
+            cmd += ' ORDER BY ' + (', '.join (order))
+        with self._dbcon as con:
+            cur = con.cursor ()
+            cur.execute (cmd, values)
+            return cur.fetchall ()
+
+
+    @timed('db.query')
+    def selectIn (self, table, field, values, **criteria):
+        """Select all fields of the given table for the records whose
+        <field> has one of the values in the list <values>.
+        This allows the data for a whole group (e.g. the pupils of a
+        class) to be fetched in a single query.
+        The <criteria> are as for <select>.
+        To stay within the sqlite limit on the number of parameters, the
+        values are passed in chunks of at most <_MAXPARAMS>.
+        """
+        clist = []
+        vlist = []
+        for c, v in criteria.items ():
+            if isinstance(v, (list, tuple)):
+                op, v = v
+            else:
+                op = '='
+            clist.append ('%s %s ?' % (c, op))
+            vlist.append (v)
+        # Remove duplicates, which could otherwise lead to repeated records
+        values = list (OrderedDict.fromkeys (values))
+        rows = []
+        with self._dbcon as con:
+            cur = con.cursor ()
+            for i in range (0, len (values), _MAXPARAMS):
+                chunk = values [i:i + _MAXPARAMS]
+                cmd = 'SELECT * FROM {} WHERE {}'.format (table,
+                        ' AND '.join (clist + ['{} IN ({})'.format (field,
+                                ','.join (['?']*len (chunk)))]))
+                cur.execute (cmd, vlist + chunk)
+                rows += cur.fetchall ()
+        return rows
+
+
     def select1 (self, table, **criteria):
         """Special select function for cases where at most 1 matching
         record is permitted.
@@ -281,6 +511,7 @@ class DB0:
                 table=table, select=repr (criteria))
 
 
+    @timed('db.update')
     def update (self, table, key, val, **criteria):
         with self._dbcon as con:
             cur = con.cursor ()
@@ -293,6 +524,7 @@ class DB0:
                     ' AND '.join (clist)), vlist)
 
 
+    @timed('db.update')
     def updateOrAdd (self, table, data, update_only=False, **criteria):
         """If an entry matching the criteria exists, update it with the
         given data (ignoring unsupplied fields).
@@ -337,6 +569,7 @@ class DB0:
             cur.execute(cmd, vlist)
 
 
+    @timed('db.update')
     def updateN (self, table, key, criteria, vals):
         """Perform a set of updates on a table.
         <table> is the name of the table.
@@ -352,6 +585,58 @@ class DB0:
                 cur.execute (cmd, rowvals)
 
 
+    @timed('db.update')
+    def updateAll (self, table, data, criteria, vals):
+        """Perform a set of updates on a table, in a single transaction.
+        <table> is the name of the table.
+        <data> is a mapping {field name -> new value}, the same for all
+        updated records.
+        <criteria> is a list of field names providing the indexing.
+        <vals> is a list of tuples/lists: (criterion1, criterion2, ...)
+        Return the number of updated records.
+        """
+        ufields = []
+        vlist = []
+        for f, v in data.items ():
+            ufields.append (f + '=?')
+            vlist.append (v)
+        cmd = 'UPDATE {} SET {} WHERE {}'.format (table,
+                ', '.join (ufields),
+                ' AND '.join ([c + '=?' for c in criteria]))
+        with self._dbcon as con:
+            cur = con.cursor ()
+            cur.executemany (cmd, [vlist + list (rowvals)
+                    for rowvals in vals])
+            return cur.rowcount
+
+
+    @timed('db.update')
+    def upsertN (self, table, fields, rows, keys, update=None):
+        """Add or update a number of records, in a single transaction.
+        <fields> is a list of field names.
+        <rows> is a list of records, each a list of values corresponding
+        to <fields>.
+        <keys> is a list of the fields covered by a unique index (e.g.
+        <GRADE_UNIQUE [0]>). If a record with the same values for these
+        fields exists already, it is updated, otherwise a new record is
+        added.
+        <update> is a list of the fields to be set when a record is updated.
+        By default these are all those in <fields> not in <keys>.
+        """
+        if update == None:
+            update = [f for f in fields if f not in keys]
+        cmd = ('INSERT INTO {}({}) VALUES({})'
+                ' ON CONFLICT({}) DO UPDATE SET {}').format (table,
+                        ','.join (fields),
+                        ','.join (['?']*len (fields)),
+                        ','.join (keys),
+                        ', '.join (['{0}=excluded.{0}'.format (f)
+                                for f in update]))
+        with self._dbcon as con:
+            cur = con.cursor ()
+            cur.executemany (cmd, rows)
+
+
     def renameTable (self, table, newName):
         with self._dbcon as con:
             cmd = 'ALTER TABLE {} RENAME TO {}'.format (table, newName)
@@ -372,8 +657,9 @@ class DB0:
         indexes = []
         with self._dbcon as con:
             cur = con.cursor ()
-            cmd = "SELECT name FROM sqlite_master WHERE type == 'index'"
-            cur.execute (cmd)
+            cmd = ("SELECT name FROM sqlite_master WHERE type == 'index'"
+                    " AND tbl_name == ? AND name NOT LIKE 'sqlite_%'")
+            cur.execute (cmd, (table,))
             for i in cur.fetchall ():
                 indexes.append (i [0])
                 cmd = 'DROP INDEX {}'.format (i [0])
@@ -414,6 +700,7 @@ class DB0:
         return fields
 
 
+    @timed('db.update')
     def addEntry (self, table, data):
         """Add a row to the given table. <data> is a <dict> containing
         entries for the fields of the table. Fields for which <data> has
@@ -433,6 +720,7 @@ class DB0:
             cur.execute (cmd, vlist)
 
 
+    @timed('db.update')
     def deleteEntry (self, table, **criteria):
         with self._dbcon as con:
             cur = con.cursor ()
@@ -466,7 +754,38 @@ class DB0:
 
 
 #TODO: Should the database contain the school year?
-class DB (DB0):
+class PooledDB (DB0):
+    """A database whose connections are taken from the process-wide pool,
+    <DBPool>, so that repeated instantiation (e.g. for each pupil of a
+    class) is cheap.
+    """
+    def _connect (self, filepath):
+        """Get a connection from the pool, checking the tables only if
+        this has not already been done for the file.
+        """
+        con, check = DBPool.get (filepath, self.readonly)
+        if check and not self.readonly:
+            self._dbcon = con
+            self._checkDB ()
+            DBPool.checked (filepath)
+        return con
+
+
+    def _release (self, filepath):
+        DBPool.evict (filepath)
+
+
+    def close (self):
+        """The pooled connection is not closed, it is just no longer
+        available to this instance.
+        """
+        self._dbcon = None
+
+
+
+class DB (PooledDB):
+    """Access to the database of a school-year.
+    """
     @staticmethod
     def getPath (schoolyear):
         return Paths.getYearPath (schoolyear, 'FILE_SQLITE')
@@ -481,6 +800,16 @@ class UpdateError(IndexError):
 
 
 
+##################### Test functions
+_testyear = 2016
+def test_01 ():
+    db1 = DB (_testyear)
+    db2 = DB (_testyear)
+    REPORT.Test ("Shared connection: %s" % (db1._dbcon is db2._dbcon))
+    REPORT.Test ("Pool: %s" % repr (list (DBPool._connections)))
+
+
+
 #def namedtuple_factory(cursor, row):
 #    """Returns sqlite rows as named tuples."""
 #    fields = [col [0] for col in cursor.description]
@@ -0,0 +1,129 @@
+# python >= 3.7
+# -*- coding: utf-8 -*-
+
+"""
+wz_core/downloads.py
+
+Last updated:  2020-02-05
+
+A store for generated files (e.g. a pdf-file with reports) which should
+be available for downloading for a limited time.
+
+The files are saved in the folder DIR_DOWNLOADS, named by the hash of
+their contents, which also serves as the "token" for retrieving them.
+Thus only this (short) token needs to be kept in the user's session.
+Files older than DOWNLOAD_MAXAGE (configuration file MISC) seconds are
+removed automatically whenever a new file is added.
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+_MAXAGE = 3600          # default time (seconds) until a file is removed
+_SUFFIX = '.dat'        # file-name suffix of the stored files
+
+import os, time, hashlib, tempfile
+
+from .configuration import Paths
+
+
+class Downloads:
+    @staticmethod
+    def folder():
+        path = Paths.getUserPath('DIR_DOWNLOADS')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+
+    @staticmethod
+    def maxage():
+        n = CONF.MISC.get('DOWNLOAD_MAXAGE')
+        return n.nat() if n else _MAXAGE
+
+
+    @classmethod
+    def store(cls, data):
+        """Save the file contents (<bytes>) <data>.
+        Return the token for retrieving the file.
+        """
+        cls.sweep()
+        token = hashlib.sha256(data).hexdigest()
+        folder = cls.folder()
+        path = os.path.join(folder, token + _SUFFIX)
+        if os.path.isfile(path):
+            # Same contents already stored, restart its time
+            os.utime(path)
+            return token
+        # Write to a temporary file first, so that an incomplete file is
+        # never visible under its final name.
+        fd, tmppath = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmppath, path)
+        except:
+            os.remove(tmppath)
+            raise
+        return token
+
+
+    @classmethod
+    def path(cls, token):
+        """Return the path to the file with the given token, or <None>
+        if it is not (or no longer) available.
+        """
+        if not (token and token.isalnum()):
+            # Only valid tokens can produce valid paths
+            return None
+        path = os.path.join(cls.folder(), token + _SUFFIX)
+        return path if os.path.isfile(path) else None
+
+
+    @classmethod
+    def sweep(cls):
+        """Remove files which are older than the maximum age.
+        """
+        folder = cls.folder()
+        tmin = time.time() - cls.maxage()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < tmin:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    # Removed by another process
+                    pass
+
+
+
+def test_01():
+    data = b'%PDF-1.4 test data'
+    token = Downloads.store(data)
+    REPORT.Test("Stored: %s" % token)
+    path = Downloads.path(token)
+    with open(path, 'rb') as fh:
+        if fh.read() != data:
+            REPORT.Fail("Stored data differs")
+    if Downloads.store(data) != token:
+        REPORT.Fail("Same contents, different token")
+    if Downloads.path('../' + token):
+        REPORT.Fail("Invalid token accepted")
+    os.utime(path, (0, 0))
+    Downloads.sweep()
+    if Downloads.path(token):
+        REPORT.Fail("Old file not removed")
@@ -0,0 +1,333 @@
+# python >= 3.7
+# -*- coding: utf-8 -*-
+
+"""
+wz_core/jobs.py
+
+Last updated:  2020-02-05
+
+Run long tasks (e.g. building the reports for a class) as background
+"jobs" in a pool of threads.
+
+The time-consuming parts of a job (e.g. the conversion of the reports to
+pdf) can be run in parallel in a pool of worker processes, using
+<runParallel>. This pool is shared by all jobs (and other callers) in a
+process, so that the number of worker processes is bounded.
+
+A job is submitted with <Jobs.submit>, which returns a job-id. The state
+of the job can be queried with <Jobs.status> and, when it has completed,
+the result (a file, as <bytes>) can be retrieved with <Jobs.fetch>.
+The jobs are recorded in an sqlite database (table JOBS) in the folder
+DIR_JOBS, the results are saved as files in the same folder. Thus all
+processes (e.g. the workers of a gunicorn server) share the job data.
+
+The messages generated by a job (via <REPORT>) are collected in the
+job's own message scope and saved with the job, so that they can be passed on
+to the user when the job is finished.
+
+A job function can report its progress by calling <progress>.
+
+If timing is enabled (see <wz_core.timing>), the timing breakdown of a
+job is also saved with it.
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+_JOBS_DB = 'jobs.sqlite3'   # the job database file (in DIR_JOBS)
+_JOB_MAXAGE = 86400         # seconds until a job is removed
+_JOB_THREADS = 2            # default number of jobs run at the same time
+
+JOB_FIELDS = ('ID', 'OWNER', 'TITLE', 'STATUS', ('PROGRESS', 'INTEGER'),
+        ('SUBMITTED', 'REAL'), ('FINISHED', 'REAL'), 'FILENAME', 'MESSAGES',
+        'TIMING')
+# Values for the STATUS field:
+JOB_WAITING = 'WAITING'
+JOB_RUNNING = 'RUNNING'
+JOB_DONE = 'DONE'
+JOB_FAILED = 'FAILED'
+
+# Messages
+_JOB_BROKEN = "Hintergrundprozess abgebrochen: {job}"
+
+
+import os, json, time, uuid, threading, traceback, multiprocessing
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+        as_completed)
+from contextvars import ContextVar
+
+from .configuration import Paths
+from .db import PooledDB
+from .timing import Timing
+
+
+class JobDB(PooledDB):
+    """The database recording the jobs. The connections are pooled, and
+    the table is only checked once per process, as the job status is
+    queried frequently (e.g. by the progress pages).
+    """
+    @staticmethod
+    def folder():
+        path = Paths.getUserPath('DIR_JOBS')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def __init__(self):
+        super().__init__(os.path.join(self.folder(), _JOBS_DB),
+                flag='CANCREATE')
+
+    def _checkDB(self):
+        if not self.tableExists('JOBS'):
+            self.makeTable2('JOBS', JOB_FIELDS, index=['ID'])
+        elif 'TIMING' not in self.tableFields('JOBS'):
+            # An older version of the table: as the jobs are only kept
+            # for a short time, it can simply be replaced.
+            self.makeTable2('JOBS', JOB_FIELDS, index=['ID'], force=True)
+
+    def resultPath(self, jobid):
+        """Return the path of the file containing the result of the
+        given job.
+        """
+        return os.path.join(os.path.dirname(self.filepath), jobid + '.dat')
+
+
+
+# The job running in the current thread: (job-id, <JobDB> instance)
+_currentJob = ContextVar('job', default=None)
+
+def progress(done, total):
+    """Report the progress of the current job, as <done> out of <total>
+    steps. Outside of a job this has no effect.
+    """
+    job = _currentJob.get()
+    if job and total:
+        jobid, db = job
+        db.update('JOBS', 'PROGRESS', int(done * 100 / total), ID=jobid)
+
+
+def _runJob(jobid, f, args, kargs):
+    """Run the job function (in a thread of the job pool).
+    The result is saved to a file, the messages and final status to the
+    JOBS table.
+    """
+    db = JobDB()
+    token = _currentJob.set((jobid, db))
+    db.update('JOBS', 'STATUS', JOB_RUNNING, ID=jobid)
+    status = JOB_FAILED
+    with REPORT.scope():
+        timing = Timing.begin()
+        try:
+            result = f(*args, **kargs)
+            if result != None:
+                with open(db.resultPath(jobid), 'wb') as fh:
+                    fh.write(result)
+                status = JOB_DONE
+        except (REPORT.RuntimeFail, REPORT.RuntimeBug):
+            pass
+        except:
+            REPORT.out(10, "Trap", traceback.format_exc())
+        finally:
+            _currentJob.reset(token)
+            timing = Timing.end(timing)
+            db.updateAll('JOBS', {'STATUS': status, 'PROGRESS': 100,
+                        'FINISHED': time.time(),
+                        'MESSAGES': json.dumps(REPORT.messages()),
+                        'TIMING': json.dumps(timing) if timing else None},
+                    ('ID',), [(jobid,)])
+
+
+
+def runParallel(f, arglist, nproc):
+    """Call <f(*args)> for each tuple <args> in <arglist>, in parallel
+    in the shared pool of worker processes (see <WorkerPool>) if <nproc>
+    is greater than 1, otherwise in the calling thread.
+    <f> must be a module-level function and the arguments and results
+    must be picklable, as they are passed to and from another process.
+    When running as a job, the progress is reported.
+    Return a list of the results, in the same order as <arglist>.
+    """
+    if nproc < 2 or len(arglist) < 2:
+        results = []
+        for args in arglist:
+            results.append(f(*args))
+            progress(len(results), len(arglist))
+        return results
+    pool = WorkerPool.get(nproc)
+    futures = [pool.submit(f, *args) for args in arglist]
+    for n, _ in enumerate(as_completed(futures), 1):
+        progress(n, len(arglist))
+    return [fut.result() for fut in futures]
+
+
+
+class WorkerPool:
+    """Manage a process-wide pool of worker processes for the
+    time-consuming parts of the jobs (see <runParallel>). As the jobs
+    run in threads, they all share this pool.
+    The processes are started using "spawn", as forking a process with
+    several threads (e.g. under gunicorn with "gthread" workers) is not
+    safe. The pool is started on first use and kept for later calls.
+    """
+    _lock = threading.Lock()
+    _pool = None
+    _size = 0
+
+    @classmethod
+    def get(cls, nproc):
+        with cls._lock:
+            if cls._pool == None or cls._size != nproc:
+                if cls._pool != None:
+                    cls._pool.shutdown(wait=False)
+                cls._pool = ProcessPoolExecutor(max_workers=nproc,
+                        mp_context=multiprocessing.get_context('spawn'))
+                cls._size = nproc
+            return cls._pool
+
+
+
+class Jobs:
+    """Manage the pool of job threads and the submission of jobs.
+    The number of jobs run at the same time may be set in the
+    configuration file MISC, as JOB_THREADS.
+    """
+    _lock = threading.Lock()
+    _pool = None
+
+    @classmethod
+    def _getPool(cls):
+        with cls._lock:
+            if cls._pool == None:
+                n = CONF.MISC.get('JOB_THREADS')
+                cls._pool = ThreadPoolExecutor(
+                        max_workers=n.nat(imin=1) if n else _JOB_THREADS,
+                        thread_name_prefix='job')
+            return cls._pool
+
+
+    @classmethod
+    def submit(cls, owner, title, filename, f, *args, **kargs):
+        """Start a job, running <f(*args, **kargs)> in a job thread.
+        <f> should return the result file as <bytes>.
+        <owner> is the user-id of the submitter, <title> a description of
+        the job and <filename> the name for the result file.
+        Return the job-id.
+        """
+        cls.purge()
+        jobid = uuid.uuid4().hex
+        db = JobDB()
+        db.addEntry('JOBS', {'ID': jobid, 'OWNER': owner, 'TITLE': title,
+                'STATUS': JOB_WAITING, 'PROGRESS': 0,
+                'SUBMITTED': time.time(), 'FILENAME': filename})
+        future = cls._getPool().submit(_runJob, jobid, f, args, kargs)
+        def done(fut):
+            # Catch failures outside of the job function (e.g. in
+            # accessing the job database)
+            if fut.exception():
+                JobDB().updateAll('JOBS', {'STATUS': JOB_FAILED,
+                        'FINISHED': time.time(),
+                        'MESSAGES': json.dumps([(8, "Fail",
+                                _JOB_BROKEN.format(job=title))])},
+                        ('ID',), [(jobid,)])
+        future.add_done_callback(done)
+        return jobid
+
+
+    @staticmethod
+    def status(jobid):
+        """Return the JOBS table entry for the given job as a mapping,
+        or <None> if there is no such job. The messages are returned as
+        a list of (error code, message type, message) tuples, the timing
+        breakdown as for <Timing.end> (or <None>).
+        """
+        row = JobDB().select1('JOBS', ID=jobid)
+        if row:
+            job = dict(row)
+            job['MESSAGES'] = [tuple(m)
+                    for m in json.loads(job['MESSAGES'] or '[]')]
+            job['TIMING'] = json.loads(job['TIMING'] or 'null')
+            return job
+        return None
+
+
+    @staticmethod
+    def clearMessages(jobid):
+        """Remove the messages (and timing breakdown) of the given job,
+        e.g. when they have been passed on to the user.
+        """
+        JobDB().updateAll('JOBS', {'MESSAGES': None, 'TIMING': None},
+                ('ID',), [(jobid,)])
+
+
+    @staticmethod
+    def fetch(jobid):
+        """Return the path to the result file of the given job, or <None>
+        if it is not (yet, or no longer) available.
+        """
+        if not jobid.isalnum():
+            # Only valid job-ids can produce valid paths
+            return None
+        path = JobDB().resultPath(jobid)
+        return path if os.path.isfile(path) else None
+
+
+    @staticmethod
+    def purge():
+        """Remove jobs – and their result files – which are older than
+        <_JOB_MAXAGE>.
+        """
+        db = JobDB()
+        for row in db.select('JOBS',
+                SUBMITTED=('<', time.time() - _JOB_MAXAGE)):
+            jobid = row['ID']
+            try:
+                os.remove(db.resultPath(jobid))
+            except FileNotFoundError:
+                pass
+            db.deleteEntry('JOBS', ID=jobid)
+
+
+
+##################### Test functions
+def _testTask(n):
+    time.sleep(0.2)
+    return (n, os.getpid())
+
+def _testJob(n, nproc):
+    return json.dumps(runParallel(_testTask, [(i,) for i in range(n)],
+            nproc)).encode('utf-8')
+
+def test_01():
+    """Run a job which dispatches its tasks to two worker processes.
+    """
+    jobid = Jobs.submit(None, "Test", 'test.json', _testJob, 6, 2)
+    t0 = time.time()
+    while Jobs.status(jobid)['STATUS'] not in (JOB_DONE, JOB_FAILED):
+        if time.time() - t0 > 60:
+            REPORT.Fail("Job not finished")
+        time.sleep(0.1)
+    path = Jobs.fetch(jobid)
+    if not path:
+        REPORT.Fail("Job failed: %s" % repr(Jobs.status(jobid)['MESSAGES']))
+    with open(path, encoding='utf-8') as fh:
+        results = json.load(fh)
+    if [n for n, pid in results] != list(range(6)):
+        REPORT.Fail("Results out of order: %s" % repr(results))
+    pids = {pid for n, pid in results}
+    if len(pids) < 2 or os.getpid() in pids:
+        REPORT.Fail("Tasks not run in parallel: %s" % repr(results))
+    REPORT.Test("Worker processes: %s" % repr(sorted(pids)))
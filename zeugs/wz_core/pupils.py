@@ -22,10 +22,16 @@ Copyright 2019-2020 Michael Towers
    limitations under the License.
 """
 
-from fnmatch import fnmatchcase
+import re, threading
+from fnmatch import translate
+from operator import attrgetter
 from collections import OrderedDict, UserList
 
 from .db import DB
+from .timing import timed
+
+_WRONGLENGTH = ("Schülerdaten haben die falsche Länge.\n  Felder: {fields}"
+                "\n  Werte: {values}")
 
 
 class Klass:
@@ -101,35 +107,90 @@ class Klass:
         ks = str(self)
         if not self.streams:
             ks += '.'
-        for item in kmap:
-            k, v = item.split(':', 1)
-            try:
-                kmin, k = k.split('<')
-            except:
-                kmin = '00'
-            if fnmatchcase(ks, k):
-                if ks >= kmin:
-                    return v.strip() or None
-        return None
+        return KlassMap.get(kmap).lookup(ks)
 
 
     def klassStreams (self, schoolyear):
         """Return a sorted list of stream names for this school-class.
         """
         return sorted ([s or '_'
-                for s in DB(schoolyear).selectDistinct ('PUPILS', 'STREAM',
+                for s in DB(schoolyear, 'READONLY').selectDistinct ('PUPILS', 'STREAM',
                         CLASS=self.klass)])
 
 
 
-class PupilData (list):
-    """A list which allows keyed access to its fields.
-    As the fields are a class attribute, this class can only be used for
-    one type of list. It is used to hold the fields of the pupil data.
-    Before instantiating, <fields> must be called to set up the field
-    names and indexes.
+class KlassMap:
+    """The compiled form of a mapping list for <Klass.match_map>.
+    The glob patterns are translated to regular expressions once and the
+    value found for each klass.stream is remembered, so that repeated
+    lookups (e.g. for all the classes in a list) cost only a dictionary
+    access.
+    The compiled mappings are shared, they are found by the contents of
+    the list, so a changed configuration gets a new one.
     """
-    _fields = None
+    _lock = threading.Lock()
+    _maps = {}
+
+    @classmethod
+    def get(cls, kmap):
+        """Return the compiled form of the mapping list <kmap>.
+        """
+        key = kmap if isinstance(kmap, tuple) else tuple(kmap)
+        try:
+            return cls._maps[key]
+        except KeyError:
+            pass
+        kmc = cls(key)
+        with cls._lock:
+            return cls._maps.setdefault(key, kmc)
+
+
+    def __init__(self, kmap):
+        # [(minimum klass.stream, compiled pattern, value), ...]
+        self._entries = []
+        for item in kmap:
+            k, v = item.split(':', 1)
+            try:
+                kmin, k = k.split('<')
+            except:
+                kmin = '00'
+            self._entries.append((kmin, re.compile(translate(k)),
+                    v.strip() or None))
+        self._memo = {}
+
+
+    def lookup(self, ks):
+        """Return the value of the first entry matching the (normalized)
+        klass.stream <ks>, see <Klass.match_map>.
+        """
+        try:
+            return self._memo[ks]
+        except KeyError:
+            pass
+        value = None
+        for kmin, rx, v in self._entries:
+            if rx.match(ks) and ks >= kmin:
+                value = v
+                break
+        self._memo[ks] = value
+        return value
+
+
+
+class PupilData:
+    """A record holding the fields of the pupil data. A field can be
+    accessed as an attribute (pdata.FIRSTNAME), by key
+    (pdata['FIRSTNAME']) or by index.
+    The field names are taken from the configuration (PUPILS_FIELDNAMES).
+    When <fields> is first called, a subclass with a slot for each field
+    is generated, whose instances are returned by <PupilData(values)>.
+    There is an extra slot, <grades>, which can hold other pupil-related
+    data for a report template (see <wz_compat.template.pupilFields>).
+    """
+    __slots__ = ()
+    _fields = None      # {field name -> index}
+    _names = None       # (field name, ...)
+    _record = None      # the generated subclass
 
     @staticmethod
     def fieldNames ():
@@ -137,55 +198,117 @@ class PupilData (list):
 
     @classmethod
     def fields (cls):
-        if cls._fields == None:
-            cls._fields = OrderedDict ()
-            i = 0
-            for f in cls.fieldNames ():
-                cls._fields [f] = i
-                i += 1
-        return cls._fields
+        if PupilData._fields == None:
+            names = tuple (PupilData.fieldNames ())
+            PupilData._names = names
+            PupilData._values = staticmethod (attrgetter (*names))
+            PupilData._record = type ('PupilRecord', (PupilData,),
+                    {'__slots__': names + ('grades',)})
+            PupilData._fields = OrderedDict ((f, i)
+                    for i, f in enumerate (names))
+        return PupilData._fields
+
+    @classmethod
+    def fromRows (cls, rows):
+        """Return a list of records for the given rows, e.g. the result
+        of a database query on the PUPILS table.
+        """
+        if not rows:
+            return []
+        cls.fields ()
+        names = PupilData._names
+        if len (rows [0]) != len (names):
+            REPORT.Fail (_WRONGLENGTH, fields=repr (names),
+                    values=repr (list (rows [0])))
+        record = PupilData._record
+        new = object.__new__
+        result = []
+        for row in rows:
+            pdata = new (record)
+            for f, v in zip (names, row):
+                setattr (pdata, f, v)
+            result.append (pdata)
+        return result
 
     #### The main part of the class, dealing with instances:
 
+    def __new__ (cls, values):
+        if cls is PupilData:
+            cls.fields ()
+            cls = PupilData._record
+        return object.__new__ (cls)
+
     def __init__ (self, values):
-        if len (values) != len (self._fields):
-            REPORT.Fail (_WRONGLENGTH, fields=repr (self._fields),
-                    values=repr (values))
-        super ().__init__ (values)
+        if len (values) != len (self._names):
+            REPORT.Fail (_WRONGLENGTH, fields=repr (self._names),
+                    values=repr (list (values)))
+        for f, v in zip (self._names, values):
+            setattr (self, f, v)
 
     def __getitem__ (self, key):
         if type (key) == str:
-            return super (). __getitem__ (self._fields [key])
-        else:
-            return super (). __getitem__ (key)
+            if key in self._fields:
+                return getattr (self, key)
+            raise KeyError (key)
+        if type (key) == slice:
+            return list (self._values (self)) [key]
+        return getattr (self, self._names [key])
 
     def __setitem__ (self, key, value):
         if type (key) == str:
-            return super (). __setitem__ (self._fields [key], value)
+            if key not in self._fields:
+                raise KeyError (key)
+            setattr (self, key, value)
         else:
-            return super (). __setitem__ (key, value)
+            setattr (self, self._names [key], value)
+
+    def __len__ (self):
+        return len (self._names)
+
+    def __iter__ (self):
+        return iter (self._values (self))
+
+    def __eq__ (self, other):
+        if isinstance (other, PupilData):
+            return self._values (self) == other._values (other)
+        return NotImplemented
+
+    def __repr__ (self):
+        return repr (list (self._values (self)))
+
+    def __reduce__ (self):
+        # The generated subclass can't be found by pickle. The <grades>
+        # slot, if set, is passed as "slot state".
+        values = (list (self._values (self)),)
+        try:
+            return (PupilData, values, (None, {'grades': self.grades}))
+        except AttributeError:
+            return (PupilData, values)
 
     def name (self):
         """Return the (short form of) pupil's name.
         """
-        return self ['FIRSTNAME'] + ' ' + self ['LASTNAME']
+        return self.FIRSTNAME + ' ' + self.LASTNAME
 
     def getKlass(self, withStream=False):
         """Return a <Klass> object for this pupil.
         If <withStream> is true, add a stream tag.
         """
         if withStream:
-            return Klass.fromKandS(self ['CLASS'], self ['STREAM'])
-        return Klass(self['CLASS'])
+            return Klass.fromKandS(self.CLASS, self.STREAM)
+        return Klass(self.CLASS)
 
     def toMapping(self):
-        return OrderedDict(map(lambda a,b: (a,b), self.fields(), self))
+        return OrderedDict(zip(self._names, self._values(self)))
 
 
 class Pupils:
-    def __init__ (self, schoolyear):
+    def __init__ (self, schoolyear, readonly=False):
+        """If <readonly> is true, the database is opened in read-only
+        mode, which is sufficient for all the methods of this class.
+        """
         self.schoolyear = schoolyear
-        self.db = DB (schoolyear)
+        self.db = DB (schoolyear, flag='READONLY' if readonly else None)
         PupilData.fields ()
 
     def classes (self):
@@ -201,6 +324,7 @@ class Pupils:
             return PupilData(pdata)
         return None
 
+    @timed('pupils.classPupils')
     def classPupils (self, klass, date=None):
         """Read the pupil data for the given school-class (possibly with
         streams).
@@ -212,22 +336,29 @@ class Pupils:
         the given streams are returned.
         To enable indexing on pupil-id, the result has an extra
         attribute, <pidmap>: {pid-> <PupilData> instance}
+        The selection is done by the database query (see the indexes
+        <wz_core.db.PUPILS_KEYS>), the pupils are ordered by PSORT.
         """
-        fetched = self.db.select('PUPILS', CLASS=klass.klass)
-        rows = UserList()
-        rows.pidmap = {}
+        clist = ['CLASS = ?']
+        vlist = [klass.klass]
         slist = klass.streams
-        for row in fetched:
-            pdata = PupilData(row)
-            # Check exit date
-            if date:
-                exd = pdata['EXIT_D']
-                if exd and exd < date:
-                    continue
-            # Check stream
-            if (not slist) or ((pdata['STREAM'] or '_') in slist):
-                rows.append (pdata)
-                rows.pidmap [pdata['PID']] = pdata
+        if slist:
+            streams = [s for s in slist if s != '_']
+            sconds = []
+            if streams:
+                sconds.append('STREAM IN (%s)' % ','.join(['?']*len(streams)))
+                vlist += streams
+            if len(streams) < len(slist):
+                # '_': pupils without a stream
+                sconds.append("STREAM IS NULL OR STREAM = ''")
+            clist.append('(%s)' % ' OR '.join(sconds))
+        if date:
+            clist.append("(EXIT_D IS NULL OR EXIT_D = '' OR EXIT_D >= ?)")
+            vlist.append(date)
+        fetched = self.db.selectWhere('PUPILS', ' AND '.join(clist), vlist,
+                order=('PSORT',))
+        rows = UserList(PupilData.fromRows(fetched))
+        rows.pidmap = {pdata.PID: pdata for pdata in rows}
         return rows
 
 
@@ -262,3 +393,34 @@ def test_04 ():
     for line in cdata:
         REPORT.Test ("     " + repr (line))
 
+def test_05 ():
+    kmap = ['13.Gym: Abgang-13.html',
+            '12.Gym: Notenzeugnis-12_SII.html',
+            '12.*: Notenzeugnis-12_SI.html',
+            '11.*:',
+            '05<*: Notenzeugnis-SI.html'
+        ]
+    for k, v in (('13.Gym', 'Abgang-13.html'),
+            ('12.Gym', 'Notenzeugnis-12_SII.html'),
+            ('12.RS', 'Notenzeugnis-12_SI.html'),
+            ('12', 'Notenzeugnis-12_SI.html'),
+            ('11.Gym', None),
+            ('10.RS', 'Notenzeugnis-SI.html'),
+            ('04.RS', None)):
+        # The second lookup uses the memo
+        for i in range(2):
+            if Klass(k).match_map(kmap) != v:
+                REPORT.Fail("match_map failed for %s" % k)
+    REPORT.Test("match_map: %s" % repr(KlassMap.get(kmap)._memo))
+
+def test_06 ():
+    import pickle
+    pdata = Pupils (2016).classPupils (Klass ('10')) [0]
+    p2 = pickle.loads (pickle.dumps (pdata))
+    if p2 != pdata or hasattr (p2, 'grades'):
+        REPORT.Fail ("Pickled pupil data differs (without grades)")
+    pdata.grades = {'De': '2'}
+    p2 = pickle.loads (pickle.dumps (pdata))
+    if p2 != pdata or p2.grades != pdata.grades:
+        REPORT.Fail ("Pickled pupil data differs (with grades)")
+    REPORT.Test ("Pickled: %s, grades: %s" % (repr (p2), repr (p2.grades)))
@@ -8,6 +8,9 @@ Last updated:  2020-01-26
 Handle the basic reporting needs of the program.
 Supports various error levels and other informative output.
 
+The log output of the web application goes to rotating log files, one
+set per user, see <LogSink>.
+
 
 =+LICENCE=============================
 Copyright 2019-2020 Michael Towers
@@ -27,7 +30,21 @@ Copyright 2019-2020 Michael Towers
 =-LICENCE========================================
 """
 
-import traceback
+_LOG_MAXBYTES = 1000000     # size at which a user's log file is rotated
+_LOG_MAXOPEN = 16           # maximum number of open log files
+_LOG_SUBFOLDER = 'p%d'      # the log folder of a process (numbered)
+_LOG_LOCKFILE = '.lock'     # marks a process's log folder as in use
+
+import os, re, atexit, queue, logging, traceback
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where there is only one server process
+    fcntl = None
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 
 class Report:
@@ -38,9 +55,14 @@ class Report:
     The method <printMessages> outputs the messages sequentially with a
     little formatting. By default the output is sent to "stdout", but it
     is also possible to set a file-path: attribute <logfile>.
-    A further possibility is to supply the method <getLogFile> which
-    returns a file-path. This method takes the message list as argument,
-    allowing additional handling of the messages.
+    A further possibility is to supply the method <getLogfile> together
+    with a <LogSink> (attribute <logSink>). <getLogfile> takes the message
+    list as argument, allowing additional handling of the messages, and
+    returns the log name (see <LogSink.write>) for the output.
+    The message list is local to the current context (thread, or asyncio
+    task), so that concurrent requests don't see each other's messages.
+    A fresh list for a block of code (e.g. a web request) can be set up
+    using <scope>, or <beginScope> and <endScope>.
     """
     class RuntimeFail(RuntimeError):
         pass
@@ -51,38 +73,78 @@ class Report:
     ### The 'structural' methods
     def __init__ (self):
         self.logfile = None # defaults to stdout
-        # A function to determine the output file, by default undefined:
+        # A function to determine the log name, by default undefined:
         self.getLogfile = None
-        self._report = []
+        # The log sink for the named logs, by default undefined:
+        self.logSink = None
+        # The message list of the current context
+        self._report = ContextVar('report', default=None)
+
+    def _messageList (self):
+        msgs = self._report.get()
+        if msgs == None:
+            msgs = []
+            self._report.set(msgs)
+        return msgs
 
     def messages (self):
-        msgs = self._report
-        self._report = []
+        msgs = self._messageList()
+        self._report.set([])
         return msgs
 
-    def printMessages(self, suppressok=False):
-        messages = self.messages()
-        try:
-            outfile = self.getLogfile(messages, suppressok)
-        except:
-            # Output to default/fallback log
-            outfile = self.logfile
+    def beginScope (self):
+        """Start a new, empty message list for the current context.
+        Return a token for <endScope>, which restores the previous list.
+        """
+        return self._report.set([])
+
+    def endScope (self, token):
+        """End a message scope started by <beginScope>. Messages which
+        have not been output are discarded.
+        """
+        self._report.reset(token)
+
+    @contextmanager
+    def scope (self):
+        """A context manager for a block with its own message list.
+        """
+        token = self.beginScope()
         try:
-            fh = (open(outfile, 'a', encoding='utf-8', newline='')
-                    if outfile else None)
-            for mi, mt, msg in messages:
-                if mi >= 4:
-                    print("\n *****", mt, "*****", file=fh)
-                    print(msg, file=fh)
-                    print("------------------------------------\n", file=fh)
-                else:
-                    print("::: %s:" % mt, msg, file=fh)
+            yield self
         finally:
-            if fh:
-                fh.close()
+            self.endScope(token)
+
+    def printMessages(self, suppressok=False):
+        messages = self.messages()
+        logname = None
+        if self.getLogfile:
+            try:
+                logname = self.getLogfile(messages, suppressok)
+            except:
+                # Output to default/fallback log
+                pass
+        if not messages:
+            return
+        lines = []
+        for mi, mt, msg in messages:
+            if mi >= 4:
+                lines.append("\n ***** %s *****\n%s\n"
+                        "------------------------------------\n\n"
+                        % (mt, msg))
+            else:
+                lines.append("::: %s: %s\n" % (mt, msg))
+        text = ''.join(lines)
+        if logname and self.logSink:
+            self.logSink.write(logname, text)
+        elif self.logfile:
+            with open(self.logfile, 'a', encoding='utf-8', newline='') as fh:
+                fh.write(text)
+        else:
+            print(text, end='')
 
     def out (self, enum, etype, msg, **kargs):
-        self._report.append ((enum, etype, msg.format (**kargs) if kargs else msg))
+        self._messageList().append ((enum, etype,
+                msg.format (**kargs) if kargs else msg))
 
 
     def wrap(self, f, *args, suppressok=False, **kargs):
@@ -122,3 +184,165 @@ class Report:
     def Bug(self, msg, **kargs):
         self.out(9, "Bug", msg, **kargs)
         raise self.RuntimeBug
+
+
+
+class LogSink:
+    """Log files for the named logs (e.g. of the users of the web
+    application) in the folder <folder>.
+    The messages are passed to the logging thread via a queue, so the
+    caller doesn't wait for the file operations. The log files are kept
+    open (up to <_LOG_MAXOPEN> of them) and are rotated when they reach
+    <maxbytes>, keeping at most <maxfiles> files per name.
+    The log files can't be shared safely between processes (e.g. the
+    workers of a gunicorn server), so each process writes to its own
+    subfolder of <folder>: the first of "p0", "p1", ... which is not in
+    use by another process (it is locked as long as the process runs).
+    """
+    def __init__ (self, folder, maxfiles=2, maxbytes=_LOG_MAXBYTES):
+        self.folder, self._lock = _processFolder(folder)
+        self._queue = queue.SimpleQueue()
+        self._handler = QueueHandler(self._queue)
+        self._files = _LogFiles(self.folder, maxfiles, maxbytes)
+        self._listener = QueueListener(self._queue, self._files)
+        self._listener.start()
+        atexit.register(self.close)
+
+    def write (self, logname, text):
+        """Add an entry to the log. The name of the log file is taken
+        from the last '-'-separated part of <logname>, the whole of
+        <logname> (e.g. "<session start time>-<user>") heads the entry.
+        """
+        record = logging.makeLogRecord({'name': 'zeugs',
+                'levelno': logging.INFO, 'levelname': 'INFO',
+                'msg': text, 'logname': logname})
+        self._handler.handle(record)
+
+    def close (self):
+        """Write out the remaining messages and close the files.
+        """
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+            self._files.close()
+            self._lock.close()      # releases the folder
+            atexit.unregister(self.close)
+
+
+
+def _processFolder (folder):
+    """Find (and create, if necessary) a subfolder of <folder> which is
+    not used by any other process. Return its path and the open lock
+    file, which must be kept open while the folder is in use.
+    """
+    n = 0
+    while True:
+        path = os.path.join(folder, _LOG_SUBFOLDER % n)
+        os.makedirs(path, exist_ok=True)
+        lock = open(os.path.join(path, _LOG_LOCKFILE), 'w')
+        if not fcntl:
+            return path, lock
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return path, lock
+        except OSError:
+            # In use by another process
+            lock.close()
+            n += 1
+
+
+
+class _LogFiles(logging.Handler):
+    """Distribute the log records to the log files. This is only called
+    from the logging thread.
+    """
+    def __init__ (self, folder, maxfiles, maxbytes):
+        super().__init__()
+        self.folder = folder
+        self.maxfiles = max(maxfiles, 1)
+        self.maxbytes = maxbytes
+        self._formatter = logging.Formatter('=== %(asctime)s %(logname)s\n'
+                '%(message)s')
+        self._open = OrderedDict()
+
+    def emit (self, record):
+        name = re.sub(r'[^\w.@]', '_', record.logname.rsplit('-', 1)[-1])
+        try:
+            handler = self._open.pop(name)
+        except KeyError:
+            if len(self._open) >= _LOG_MAXOPEN:
+                self._open.popitem(last=False)[1].close()
+            handler = RotatingFileHandler(
+                    os.path.join(self.folder, name + '.log'),
+                    maxBytes=self.maxbytes, backupCount=self.maxfiles - 1,
+                    encoding='utf-8')
+            handler.terminator = ''
+            handler.setFormatter(self._formatter)
+        self._open[name] = handler
+        handler.handle(record)
+
+    def close (self):
+        while self._open:
+            self._open.popitem()[1].close()
+        super().close()
+
+
+
+##################### Test functions
+def test_01 ():
+    import threading
+    report = Report ()
+    results = {}
+    def run (i):
+        with report.scope ():
+            for n in range (100):
+                report.Info ("Thread {i}: {n}", i=i, n=n)
+            results [i] = report.messages ()
+    threads = [threading.Thread (target=run, args=(i,)) for i in range (4)]
+    for t in threads:
+        t.start ()
+    for t in threads:
+        t.join ()
+    for i, msgs in results.items ():
+        if len (msgs) != 100 or any (not m [2].startswith ("Thread %d:" % i)
+                for m in msgs):
+            REPORT.Fail ("Messages mixed between threads")
+    REPORT.Test ("Messages of %d threads kept apart" % len (results))
+
+
+def test_02 ():
+    import tempfile
+    with tempfile.TemporaryDirectory () as folder:
+        sink = LogSink (folder, maxfiles=2, maxbytes=1000)
+        for n in range (100):
+            sink.write ("2020-02-05T10:00:00-u%d" % (n % 3),
+                    "::: Info: message %d\n" % n)
+        sink.close ()
+        files = sorted (os.listdir (sink.folder))
+        if files != [_LOG_LOCKFILE, 'u0.log', 'u0.log.1', 'u1.log',
+                'u1.log.1', 'u2.log', 'u2.log.1']:
+            REPORT.Fail ("Unexpected log files: %s" % repr (files))
+        with open (os.path.join (sink.folder, 'u1.log'),
+                encoding='utf-8') as fh:
+            text = fh.read ()
+        if "message 97" not in text or "message 98" in text:
+            REPORT.Fail ("Messages in wrong log file")
+    REPORT.Test ("Log files: %s" % repr (files))
+
+
+def test_03 ():
+    import tempfile
+    with tempfile.TemporaryDirectory () as folder:
+        # As if in two processes: the folder is locked by the first sink
+        sink1 = LogSink (folder)
+        sink2 = LogSink (folder)
+        folders = [os.path.basename (sink1.folder),
+                os.path.basename (sink2.folder)]
+        sink1.close ()
+        sink3 = LogSink (folder)
+        folders.append (os.path.basename (sink3.folder))
+        sink2.close ()
+        sink3.close ()
+        if folders != ['p0', 'p1', 'p0']:
+            REPORT.Fail ("Log folders not separated: %s" % repr (folders))
+    REPORT.Test ("Log folders: %s" % repr (folders))
@@ -35,17 +35,31 @@ from collections import OrderedDict
 from wz_core.configuration import Paths
 # To read teacher table:
 from wz_table.dbtable import readDBTable
+from wz_table.spreadsheet import Spreadsheet
 
 
 class TeacherData (OrderedDict):
     """Manage the teacher list. This data is read in from a table in
     the file <TEACHERDATA_FILENAME>.
     """
+    # The teacher data is cached, keyed by school-year:
+    #   {schoolyear -> (file stamp, <TeacherData> instance)}
+    _cache = {}
+
     def __init__ (self, schoolyear):
         """Build a representation of the teacher table.
+        The table is only read again if the file has changed.
         """
         filepath = Paths.getYearPath (schoolyear, 'FILE_TEACHERDATA')
         super ().__init__ ()
+        stamp = Spreadsheet.fileStamp (filepath)
+        try:
+            _stamp, tdata = self._cache [schoolyear]
+            if _stamp == stamp:
+                self.update (tdata)
+                return
+        except KeyError:
+            pass
 
         # An exception is raised if there is no file:
         table = readDBTable (filepath)
@@ -69,6 +83,7 @@ class TeacherData (OrderedDict):
             for f, col in colmap.items ():
                 rowdata [f] = row [col]
             self [row [0]] = rowdata
+        self._cache [schoolyear] = (stamp, OrderedDict (self))
 
 
     def getTeacherName (self, tid):
@@ -0,0 +1,238 @@
+# python >= 3.7
+# -*- coding: utf-8 -*-
+
+"""
+wz_core/timing.py
+
+Last updated:  2020-02-05
+
+Optional timing of the stages of a task (e.g. a web request or a
+background job), to find out where the time is spent.
+
+The time spent in a stage is measured by <timed>, which can be used as
+a context manager:
+    with timed('pdf.merge'):
+        ...
+or as a function decorator:
+    @timed('db.select')
+    def select(...):
+        ...
+The times are only measured within a "timing scope" (see <Timing.begin>
+and <Timing.end>), which collects the number of calls and total time for
+each stage. Scopes are only started when timing is enabled (configuration
+file MISC, TIMING = 1), otherwise the cost of a <timed> stage is a
+single lookup.
+Stages may be nested (e.g. database queries within the preparation of
+the reports), the time of the inner stage is then also included in that
+of the outer one.
+
+The finished breakdowns are passed to <Timing.record>, which keeps the
+latest ones (for display in the web application) and writes them to the
+log "timing".
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+_TIMING_KEEP = 50       # number of breakdowns kept for display
+_TIMING_LOG = 'timing'  # name of the log for the breakdowns
+
+import time, threading
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+
+
+class Timing:
+    # Set to <True> or <False> to override the configuration setting:
+    enabled = None
+    # The breakdown of the current scope: {stage -> [calls, seconds]}
+    _current = ContextVar('timing', default=None)
+    _lock = threading.Lock()
+    # The latest breakdowns: [(time, label, seconds, breakdown), ...]
+    _recent = deque(maxlen=_TIMING_KEEP)
+    # Totals for all recorded breakdowns: {stage -> [calls, seconds]}
+    _totals = {}
+
+    @classmethod
+    def isEnabled(cls):
+        if cls.enabled == None:
+            try:
+                n = CONF.MISC.get('TIMING')
+            except NameError:
+                # Configuration not loaded (e.g. a rendering process)
+                return False
+            cls.enabled = bool(n and n.nat())
+        return cls.enabled
+
+
+    @classmethod
+    def begin(cls):
+        """Start a timing scope in the current context (thread, etc.), if
+        timing is enabled. Return a token for <end>.
+        """
+        if cls.isEnabled():
+            return (cls._current.set({}), time.perf_counter())
+        return None
+
+
+    @classmethod
+    def end(cls, token):
+        """End the timing scope started by <begin>.
+        Return the breakdown as a tuple (total seconds,
+        {stage -> [calls, seconds]}), or <None> if timing is disabled.
+        """
+        if token == None:
+            return None
+        ctoken, t0 = token
+        breakdown = cls._current.get()
+        cls._current.reset(ctoken)
+        return (time.perf_counter() - t0, breakdown)
+
+
+    @classmethod
+    def add(cls, stage, seconds):
+        """Add a call of the given stage, taking <seconds>, to the current
+        scope. Outside of a scope this has no effect.
+        """
+        breakdown = cls._current.get()
+        if breakdown != None:
+            try:
+                entry = breakdown[stage]
+                entry[0] += 1
+                entry[1] += seconds
+            except KeyError:
+                breakdown[stage] = [1, seconds]
+
+
+    @classmethod
+    def record(cls, label, result):
+        """Keep the result of <end> for display and write it to the log.
+        <label> describes the timed task (e.g. the url of a request).
+        """
+        if not result:
+            return
+        seconds, breakdown = result
+        with cls._lock:
+            cls._recent.appendleft((time.time(), label, seconds, breakdown))
+            for stage, (n, t) in breakdown.items():
+                try:
+                    entry = cls._totals[stage]
+                    entry[0] += n
+                    entry[1] += t
+                except KeyError:
+                    cls._totals[stage] = [n, t]
+        try:
+            sink = REPORT.logSink
+        except NameError:
+            sink = None
+        if sink:
+            sink.write(_TIMING_LOG, cls.format(label, result))
+
+
+    @staticmethod
+    def format(label, result):
+        """Return the result of <end> as text, the stages sorted by time.
+        """
+        seconds, breakdown = result
+        lines = ["%s: %.3f s\n" % (label, seconds)]
+        for stage, (n, t) in sorted(breakdown.items(),
+                key=lambda item: item[1][1], reverse=True):
+            lines.append("  %-28s %6d × %9.3f s\n" % (stage, n, t))
+        return ''.join(lines)
+
+
+    @classmethod
+    def recent(cls):
+        """Return a list of the latest breakdowns, the newest first:
+            [(time, label, seconds, {stage -> [calls, seconds]}), ...]
+        """
+        with cls._lock:
+            return list(cls._recent)
+
+
+    @classmethod
+    def totals(cls):
+        """Return the totals for all recorded breakdowns as a sorted list:
+            [(stage, calls, seconds), ...]
+        """
+        with cls._lock:
+            return sorted((stage, n, t)
+                    for stage, (n, t) in cls._totals.items())
+
+
+
+class timed:
+    """Measure the time spent in a stage, see the module documentation.
+    """
+    __slots__ = ('stage', '_t0')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._t0 = None
+
+    def __enter__(self):
+        if Timing._current.get() != None:
+            self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._t0 != None:
+            Timing.add(self.stage, time.perf_counter() - self._t0)
+            self._t0 = None
+
+    def __call__(self, f):
+        stage = self.stage
+        @wraps(f)
+        def wrapper(*args, **kargs):
+            if Timing._current.get() == None:
+                return f(*args, **kargs)
+            t0 = time.perf_counter()
+            try:
+                return f(*args, **kargs)
+            finally:
+                Timing.add(stage, time.perf_counter() - t0)
+        return wrapper
+
+
+
+##################### Test functions
+def test_01():
+    @timed('test.f')
+    def f(n):
+        time.sleep(0.001 * n)
+        return n
+    enabled = Timing.enabled
+    Timing.enabled = True
+    try:
+        token = Timing.begin()
+        for n in range(3):
+            f(n)
+        with timed('test.block'):
+            f(1)
+        result = Timing.end(token)
+    finally:
+        Timing.enabled = enabled
+    seconds, breakdown = result
+    if breakdown['test.f'][0] != 4 or breakdown['test.block'][0] != 1:
+        REPORT.Fail("Wrong call counts: %s" % repr(breakdown))
+    if not breakdown['test.block'][1] <= breakdown['test.f'][1] <= seconds:
+        REPORT.Fail("Inconsistent times: %s" % repr(result))
+    # Outside of a scope nothing is measured
+    f(0)
+    Timing.add('test.f', 1.0)
+    REPORT.Test(Timing.format('test_01', result))
@@ -50,9 +50,10 @@ import os
 from collections import OrderedDict
 
 from wz_core.configuration import Paths
-from wz_core.db import DB, UpdateError
+from wz_core.db import DB, GRADE_FIELDS, GRADE_UNIQUE
 from wz_core.pupils import Pupils, Klass
 from wz_core.courses import CourseTables
+from wz_core.timing import timed
 from wz_compat.template import getGradeTemplate, getTemplateTags
 from wz_table.dbtable import readDBTable
 
@@ -139,19 +140,15 @@ def grades2db(schoolyear, gtable, term=None):
 
 #TODO: Sanitize input ... only valid grades?
 
-    # Now enter to database
+    # Now enter to database, all pupils in a single transaction
     if p2grades:
         db = DB(schoolyear)
-        for pid, grades in p2grades.items():
-            gstring = map2grades(grades)
-            db.updateOrAdd('GRADES',
-                    {   'KLASS': klass.klass, 'STREAM': p2stream[pid],
-                        'PID': pid, 'TERM': rtag, 'REPORT_TYPE': None,
-                        'DATE_D': None, 'GRADES': gstring
-                    },
-                    TERM=rtag,
-                    PID=pid
-            )
+        db.upsertN('GRADES', GRADE_FIELDS,
+                [(klass.klass, p2stream[pid], pid, rtag, None, None,
+                        map2grades(grades))
+                    for pid, grades in p2grades.items()],
+                GRADE_UNIQUE[0]
+        )
         REPORT.Info(_NEWGRADES, n=len(p2grades),
                 klass=klass, year=schoolyear, term=rtag)
     else:
@@ -187,44 +184,60 @@ def updateGradeReport(schoolyear, pid, term, date, rtype):
     For term reports, update only DATE_D and REPORT_TYPE fields.
     This is not used for "extra" reports.
     """
+    updateGradeReports(schoolyear, [pid], term, date, rtype)
+
+
+
+def updateGradeReports(schoolyear, pids, term, date, rtype):
+    """Update grade database when building reports for a group of pupils.
+    This is like <updateGradeReport>, but all the entries (pupils in
+    the list <pids>) are updated in a single transaction.
+    """
     db = DB(schoolyear)
     termn = int(term)   # check that term (not date) is given
-    try:
-        # Update term. This only works if there is already an entry.
-        db.updateOrAdd ('GRADES',
-                {'DATE_D': date, 'REPORT_TYPE': rtype},
-                update_only=True,
-                PID=pid, TERM=term
-        )
-    except UpdateError:
-        REPORT.Bug("No entry in db, table GRADES for: PID={pid}, TERM={term}",
-                pid=pid, term=term)
+    # Update term. This only works if there is already an entry.
+    n = db.updateAll('GRADES',
+            {'DATE_D': date, 'REPORT_TYPE': rtype},
+            ('PID', 'TERM'),
+            [(pid, term) for pid in pids]
+    )
+    if n < len(pids):
+        found = {row['PID']
+                for row in db.selectIn('GRADES', 'PID', pids, TERM=term)}
+        for pid in pids:
+            if pid not in found:
+                REPORT.Bug("No entry in db, table GRADES for:"
+                        " PID={pid}, TERM={term}", pid=pid, term=term)
 
 
 
+@timed('grades.db2grades')
 def db2grades(schoolyear, term, klass, checkonly=False):
     """Fetch the grades for the given school-class/group, term, schoolyear.
     Return a list [(pid, pname, {subject -> grade}), ...]
     <klass> is a <Klass> instance, which can include a list of streams
     (including '_' for pupils without a stream). If there are streams,
     only grades for pupils in one of these streams will be included.
+    The grades for the whole group are fetched in a single query.
     """
-    slist = klass.streams
-    plist = []
-    # Get the pupils from the pupils db and search for grades for these.
+    # Get the pupils from the pupils db (<classPupils> handles the stream
+    # filter) and search for grades for these.
     pupils = Pupils(schoolyear)
+    pdlist = pupils.classPupils(klass)
     db = DB(schoolyear)
-    for pdata in pupils.classPupils(klass):
-        # Check pupil's stream if there is a stream filter
-        pstream = pdata['STREAM']
-        if slist and (pstream not in slist):
-            continue
+    pid2grades = {gdata['PID']: gdata
+            for gdata in db.selectIn('GRADES', 'PID',
+                    [pdata['PID'] for pdata in pdlist], TERM=term)
+    }
+    plist = []
+    for pdata in pdlist:
         pid = pdata['PID']
-        gdata = db.select1('GRADES', PID=pid, TERM=term)
+        gdata = pid2grades.get(pid)
         if gdata:
             gstring = gdata['GRADES'] or None
             if gstring:
-                if gdata['KLASS'] != klass.klass or gdata['STREAM'] != pstream:
+                if (gdata['KLASS'] != klass.klass
+                        or gdata['STREAM'] != pdata['STREAM']):
                     # Pupil has switched klass and/or stream.
                     # This can only be handled via individual view.
                     gstring = None
@@ -253,17 +266,35 @@ def getGradeData(schoolyear, pid, term):
     db = DB(schoolyear)
     gdata = db.select1('GRADES', PID=pid, TERM=term)
     if gdata:
-        # Convert the grades to a <dict>
-        gmap = dict(gdata)
-        try:
-            gmap['GRADES'] = grades2map(gdata['GRADES'])
-        except ValueError:
-            REPORT.Fail(_BAD_GRADE_DATA, pid=pid, term=term)
-        return gmap
+        return _gradeData(gdata)
     return None
 
 
 
+def getGradeDataN(schoolyear, pids, term):
+    """Return the data from the database GRADES table for the given
+    pupils as a mapping: {pid -> grade data}. The grade data is as
+    returned by <getGradeData>. Pupils with no entry are not included.
+    All entries are fetched in a single query.
+    """
+    db = DB(schoolyear)
+    return {gdata['PID']: _gradeData(gdata)
+            for gdata in db.selectIn('GRADES', 'PID', pids, TERM=term)}
+
+
+def _gradeData(gdata):
+    """Convert a GRADES table entry to a mapping, with the string in
+    field 'GRADES' converted to a mapping.
+    """
+    gmap = dict(gdata)
+    try:
+        gmap['GRADES'] = grades2map(gdata['GRADES'])
+    except ValueError:
+        REPORT.Fail(_BAD_GRADE_DATA, pid=gdata['PID'], term=gdata['TERM'])
+    return gmap
+
+
+
 def grades2map(gstring):
     """Convert a grade string from the database to a mapping:
         {sid -> grade}
@@ -353,6 +384,7 @@ class GradeReportData:
             REPORT.Error(_UNGROUPED_SID, sid=sid, tfile=self.template.filename)
 
 
+    @timed('grades.getTagmap')
     def getTagmap(self, grades, pname, grademap='GRADES'):
         """Prepare tag mapping for substitution in the report template,
         for the pupil <pname>.
@@ -37,7 +37,7 @@ from wz_core.configuration import Paths
 from wz_core.pupils import Pupils, Klass
 from wz_core.courses import CourseTables
 from wz_table.matrix import KlassMatrix
-from .gradedata import getGradeData
+from .gradedata import getGradeDataN
 
 
 def makeGradeTable(schoolyear, term, klass, title):
@@ -94,14 +94,17 @@ def makeGradeTable(schoolyear, term, klass, title):
 
     ### Add pupils
     pupils = Pupils(schoolyear)
-    for pdata in pupils.classPupils(klass):
+    plist = pupils.classPupils(klass)
+    # Fetch the existing grades for the whole group
+    pid2gd = getGradeDataN(schoolyear, list(plist.pidmap), term)
+    for pdata in plist:
         row = table.nextrow()
         pid = pdata['PID']
         table.write(row, 0, pid)
         table.write(row, 1, pdata.name())
         table.write(row, 2, pdata['STREAM'])
         # Add existing grades
-        gd = getGradeData(schoolyear, pid, term)
+        gd = pid2gd.get(pid)
 #        print("\n???", pid, gd)
         if gd:
             grades = gd['GRADES']
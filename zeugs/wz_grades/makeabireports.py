@@ -80,14 +80,12 @@ def readTableData (filepath, table=None):
     """
     kvmap = {}
     ss = Spreadsheet (filepath)
-    if table != None:
-        ss.setTable (table)
-    for row in range (ss.colLen ()):
-        key = ss.getValue (row, 0)
+    for row in ss.iterRows (table):
+        key = row [0] if row else None
         if (not key) or (key == '#'):
             continue
-        value = ss.getValue (row, 1)
-        kvmap [key] = value
+        kvmap [key] = row [1] if len (row) > 1 else None
+    ss.close ()
     return kvmap
 
 
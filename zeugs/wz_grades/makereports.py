@@ -42,18 +42,21 @@ _PUPILS_NOT_IN_CLASS_STREAM = "Schüler {pids} nicht in Klasse/Gruppe {ks}"
 _MADEKREPORTS = "Notenzeugnisse für Klasse {ks} wurden erstellt"
 _NOPUPILS = "Notenzeugnisse: keine Schüler"
 _MADEPREPORT = "Notenzeugnis für {pupil} wurde erstellt"
+_NOGRADES = "Klasse/Gruppe {ks}: keine Noten für Halbjahr {term}"
+_GROUPFAILED = "Zeugnisse für Klasse/Gruppe {ks} konnten nicht erstellt werden"
+_MADEALLREPORTS = "Notenzeugnisse für {n} Klassen/Gruppen wurden erstellt"
 
 
-import os
-
-from weasyprint import HTML, CSS
-from weasyprint.fonts import FontConfiguration
+import os, io, json, zipfile
 
 from wz_core.configuration import Paths, Dates
 from wz_core.pupils import Pupils, Klass
+from wz_core.timing import timed
 from wz_compat.config import printSchoolYear, printStream
+from wz_io.htmlpdf import renderPdf, renderPdfs, PdfCache
+from wz_compat.grade_classes import gradeGroups
 from wz_grades.gradedata import (GradeReportData,
-        db2grades, getGradeData, updateGradeReport)
+        db2grades, getGradeData, updateGradeReport, updateGradeReports)
 
 
 def makeReports(schoolyear, term, klass, date, pids=None):
@@ -67,6 +70,65 @@ def makeReports(schoolyear, term, klass, date, pids=None):
     <klass> is a <Klass> instance: it can be a just a school-class,
     but it can also have a stream, or list of streams.
     """
+    # Convert to pdf (possibly in parallel), reusing the cached
+    # reports of unchanged pupils
+    pdfBytes = renderPdf(*_prepareReports(schoolyear, term, klass,
+            date, pids))
+    REPORT.Info(_MADEKREPORTS, ks=klass)
+    return pdfBytes
+
+
+
+def makeAllReports(schoolyear, term, date):
+    """Build the reports for all the groups of the given term (see
+    <gradeGroups>), for all pupils with grades.
+    The reports of all groups are rendered together – in parallel, if
+    enabled, using the worker processes shared by the background jobs
+    (see <wz_core.jobs.runParallel>). A group which cannot be handled is reported and skipped.
+    <date> is the date of issue ('YYYY-MM-DD').
+    Return a zip-file (<bytes>) containing a pdf-file for each group and
+    a manifest, "manifest.json", listing the groups:
+        [{"group": group, "file": file name or null, "pupils": number},
+            ...]
+    """
+    manifest = []
+    documents = []
+    for ks in gradeGroups(term):
+        klass = Klass(ks)
+        entry = {'group': str(klass), 'file': None, 'pupils': 0}
+        manifest.append(entry)
+        pids = [pid for pid, pname, ok in db2grades(schoolyear, term,
+                klass, checkonly=True) if ok]
+        if not pids:
+            REPORT.Warn(_NOGRADES, ks=klass, term=term)
+            continue
+        try:
+            documents.append(_prepareReports(schoolyear, term, klass,
+                    date, pids))
+        except (REPORT.RuntimeFail, REPORT.RuntimeBug):
+            REPORT.Error(_GROUPFAILED, ks=klass)
+            continue
+        entry['file'] = 'Notenzeugnis_%s.pdf' % klass
+        entry['pupils'] = len(pids)
+    pdfs = iter(renderPdfs(documents))
+    zbytes = io.BytesIO()
+    with zipfile.ZipFile(zbytes, 'w') as zfile:
+        for entry in manifest:
+            if entry['file']:
+                zfile.writestr(entry['file'], next(pdfs))
+        zfile.writestr('manifest.json', json.dumps(manifest, indent=2))
+    REPORT.Info(_MADEALLREPORTS, n=len(documents))
+    return zbytes.getvalue()
+
+
+
+@timed('reports.prepare')
+def _prepareReports(schoolyear, term, klass, date, pids=None):
+    """Prepare the reports for the given pupils (see <makeReports>),
+    updating the grade database.
+    Return a tuple of arguments for <renderPdf>:
+        (render function, pupil list, base_url, cache keys).
+    """
     # <db2grades> returns a list: [(pid, pname, grade map), ...]
     # <grades>: {pid -> (pname, grade map)}
     grades = {pid: (pname, gmap)
@@ -105,34 +167,36 @@ def makeReports(schoolyear, term, klass, date, pids=None):
         # Build a grade mapping for the tags of the template:
         pdata.grades = reportData.getTagmap(gmap, pname, grademap)
         pmaplist.append(pdata)
-        # Update grade database
-        updateGradeReport(schoolyear, pid, term,
-                date=date,
-                rtype=rtype
-        )
+    # Update grade database (all pupils in one transaction)
+    updateGradeReports(schoolyear, [pdata['PID'] for pdata in pmaplist],
+            term,
+            date=date,
+            rtype=rtype
+    )
 
     ### Generate html for the reports
+    if not plist:
+        REPORT.Fail(_NOPUPILS)
 # Testing:
 #    n = 0  # with change below, just generate nth of list
 #    print("§§§", pmaplist[n])
-    source = reportData.template.render(
-            report_type = rtype,
-            SCHOOLYEAR = printSchoolYear(schoolyear),
-            DATE_D = date,
-            todate = Dates.dateConv,
-            STREAM = printStream,
-            pupils = pmaplist,
-#            pupils = [pmaplist[n]],
-            klass = klass
-        )
-    # Convert to pdf
-    if not plist:
-        REPORT.Fail(_NOPUPILS)
-    html = HTML(string=source,
-            base_url=os.path.dirname(reportData.template.filename))
-    pdfBytes = html.write_pdf(font_config=FontConfiguration())
-    REPORT.Info(_MADEKREPORTS, ks=klass)
-    return pdfBytes
+    @timed('template.render')
+    def render(pupils):
+        return reportData.template.render(
+                report_type = rtype,
+                SCHOOLYEAR = printSchoolYear(schoolyear),
+                DATE_D = date,
+                todate = Dates.dateConv,
+                STREAM = printStream,
+                pupils = pupils,
+#                pupils = [pmaplist[n]],
+                klass = klass
+            )
+    with timed('reports.cacheKeys'):
+        keys = _cacheKeys(reportData, pmaplist, schoolyear, klass, date,
+                rtype)
+    return (render, pmaplist,
+            os.path.dirname(reportData.template.filename), keys)
 
 
 
@@ -164,25 +228,40 @@ def makeOneSheet(schoolyear, date, pdata, term, rtype):
                 rtype=rtype
         )
 
-    ### Generate html for the reports
-    source = reportData.template.render(
-            report_type = rtype,
-            SCHOOLYEAR = printSchoolYear(schoolyear),
-            DATE_D = date,
-            todate = Dates.dateConv,
-            STREAM = printStream,
-            pupils = [pdata],
-            klass = klass
-        )
-    # Convert to pdf
-    html = HTML(string=source,
-            base_url=os.path.dirname(reportData.template.filename))
-    pdfBytes = html.write_pdf(font_config=FontConfiguration())
+    ### Generate html for the report
+    @timed('template.render')
+    def render(pupils):
+        return reportData.template.render(
+                report_type = rtype,
+                SCHOOLYEAR = printSchoolYear(schoolyear),
+                DATE_D = date,
+                todate = Dates.dateConv,
+                STREAM = printStream,
+                pupils = pupils,
+                klass = klass
+            )
+    # Convert to pdf (possibly cached)
+    keys = _cacheKeys(reportData, [pdata], schoolyear, klass, date, rtype)
+    pdfBytes = renderPdf(render, [pdata],
+            os.path.dirname(reportData.template.filename), keys)
     REPORT.Info(_MADEPREPORT, pupil=pname)
     return pdfBytes
 
 
 
+def _cacheKeys(reportData, pupils, schoolyear, klass, date, rtype):
+    """Return a list of cache keys (see <PdfCache>) for the reports of
+    the given pupils, whose <grades> attribute must already contain
+    the tag mapping. The keys cover the template, the pupil and grade
+    data and the other values passed to the template.
+    """
+    stamp = PdfCache.templateStamp(reportData.template.filename)
+    return [PdfCache.key(stamp, rtype, schoolyear, str(klass), date,
+                list(pdata), pdata.grades)
+            for pdata in pupils]
+
+
+
 ##################### Test functions
 _year = 2016
 _date = '2016-01-29'
@@ -0,0 +1,317 @@
+# python >= 3.7
+# -*- coding: utf-8 -*-
+
+"""
+wz_io/htmlpdf.py
+
+Last updated:  2020-02-05
+
+Conversion of html documents (the output of the jinja templates) to pdf,
+using weasyprint.
+
+The items of a long document (e.g. the reports for the pupils of a
+whole class) are rendered individually – in parallel, using a pool of
+worker processes, if enabled – and the resulting pdf-files are merged,
+retaining their order.
+
+The pdf for a single item (e.g. the report for one pupil) can be cached
+(see <PdfCache>), so that only changed items need to be rendered again.
+
+The font configuration for the documents rendered from a folder is kept
+for later calls, see <RenderContext>.
+
+=+LICENCE=============================
+Copyright 2020 Michael Towers
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+=-LICENCE========================================
+"""
+
+_CACHE_FOLDER = 'pdf'       # subfolder of DIR_CACHE for the pdf-cache
+_CACHE_MAXAGE = 7 * 86400   # seconds until an unused cache entry is removed
+_CACHE_SWEEP = 3600         # seconds between removals of unused entries
+_CACHE_SWEEPFILE = '.sweep' # its modification time is that of the last sweep
+
+# The references to other templates and to resources (e.g. fonts, images)
+# in a template, see <PdfCache.templateStamp>
+_TEMPLATE_REFS = r'''{%-?\s*(?:extends|include|import|from)\s+['"]([^'"]+)['"]'''
+_RESOURCE_REFS = r'''(?:url\(\s*['"]?|src\s*=\s*['"])([^'"()\s]+)'''
+
+import os, re, io, time, hashlib, tempfile, threading
+
+from weasyprint import HTML
+from weasyprint.fonts import FontConfiguration
+from pdfrw import PdfReader, PdfWriter
+
+from wz_core.configuration import Paths
+from wz_core.jobs import runParallel
+from wz_core.timing import timed
+
+
+def renderProcesses():
+    """Return the number of worker processes to use for pdf rendering.
+    This is set in the configuration file MISC, as RENDER_PROCESSES.
+    If the entry is missing or less than 2, the rendering is done in
+    the calling process. The worker processes are shared by all the
+    background jobs of a server process (see <wz_core.jobs.WorkerPool>).
+    """
+    n = CONF.MISC.get('RENDER_PROCESSES')
+    return n.nat() if n else 0
+
+
+@timed('pdf.weasyprint')
+def html2pdf(source, base_url):
+    """Convert an html document (string) to pdf.
+    <base_url> is used to resolve relative links (e.g. images, fonts,
+    stylesheets).
+    Return the pdf as <bytes>.
+    """
+    context = RenderContext.get(base_url)
+    html = HTML(string=source, base_url=base_url)
+    return html.write_pdf(font_config=context.font_config)
+
+
+@timed('pdf.merge')
+def mergePdfs(pdflist):
+    """Concatenate the pages of the pdf-files (<bytes>) in <pdflist>.
+    Return the resulting pdf as <bytes>.
+    """
+    writer = PdfWriter()
+    for pdfBytes in pdflist:
+        writer.addpages(PdfReader(fdata=pdfBytes).pages)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def renderPdf(render, items, base_url, keys):
+    """Build a pdf-file from a list of items (e.g. pupils), whose
+    html is generated by the function <render>. This function takes a
+    list of items (a subset of <items>) as argument and returns the
+    html source (string) for these.
+    <keys> is a list of cache keys (see <PdfCache>), one for each item.
+    The items are rendered individually – in parallel if enabled (see
+    <renderProcesses>) – and only those not already in the cache need
+    to be rendered. The order of the items is retained.
+    Return the pdf as <bytes>.
+    """
+    return renderPdfs([(render, items, base_url, keys)])[0]
+
+
+def renderPdfs(documents):
+    """Build several pdf-files, each from a list of items (e.g. the
+    reports for the pupils of a number of classes).
+    <documents> is a list of tuples (render, items, base_url, keys),
+    the elements being as for <renderPdf>, with a cache key for each
+    item. The items are rendered individually – those which are not
+    already cached all together, in parallel if enabled.
+    Return a list of the pdfs (<bytes>), one for each document.
+    """
+    cache = PdfCache()
+    results = []
+    missing = []    # [(pdf list, index, key), ...]
+    sources = []    # [(html source, base_url), ...]
+    for render, items, base_url, keys in documents:
+        pdfs = [cache.get(key) for key in keys]
+        for i, pdf in enumerate(pdfs):
+            if pdf == None:
+                missing.append((pdfs, i, keys[i]))
+                sources.append((render([items[i]]), base_url))
+        results.append(pdfs)
+    for (pdfs, i, key), pdf in zip(missing,
+            _renderAll(sources, renderProcesses())):
+        cache.put(key, pdf)
+        pdfs[i] = pdf
+    return [pdfs[0] if len(pdfs) == 1 else mergePdfs(pdfs)
+            for pdfs in results]
+
+
+def _renderAll(sources, nproc):
+    """Convert the html documents in the list <sources> – tuples
+    (html source, base_url) – in parallel if <nproc> > 1.
+    Return a list of the resulting pdfs (<bytes>), in the same order.
+    """
+    if nproc < 2 or len(sources) < 2:
+        return runParallel(html2pdf, sources, nproc)
+    with timed('pdf.parallel'):
+        return runParallel(html2pdf, sources, nproc)
+
+
+
+class RenderContext:
+    """The data for rendering documents from a particular (template)
+    folder which can be shared between calls: the weasyprint font
+    configuration, so that the fonts need only be found and loaded once.
+    weasyprint is not thread-safe, so each thread has its own contexts.
+    """
+    _local = threading.local()
+
+    @classmethod
+    def get(cls, base_url):
+        """Return the context for the folder <base_url>.
+        """
+        try:
+            contexts = cls._local.contexts
+        except AttributeError:
+            contexts = {}
+            cls._local.contexts = contexts
+        try:
+            return contexts[base_url]
+        except KeyError:
+            context = cls(base_url)
+            contexts[base_url] = context
+            return context
+
+
+    def __init__(self, base_url):
+        self.folder = base_url
+        self.font_config = FontConfiguration()
+
+
+
+class PdfCache:
+    """A cache for rendered pdf documents, saved as files in the folder
+    DIR_CACHE. The cache key (see <key>) must cover all the data which
+    is used to build the document.
+    Entries which have not been used for <_CACHE_MAXAGE> seconds are
+    removed (see <sweep>).
+    """
+    def __init__(self):
+        self.folder = os.path.join(Paths.getUserPath('DIR_CACHE'),
+                _CACHE_FOLDER)
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.sweep()
+
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from the given parts, whose <repr> must
+        represent their contents completely (e.g. strings, numbers,
+        tuples and lists of these). Mappings are sorted.
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, dict):
+                part = sorted(part.items())
+            h.update(repr(part).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+
+    @staticmethod
+    def templateStamp(filepath):
+        """Return a cache-key part for the template file <filepath>,
+        covering its contents, those of the templates it uses (extends,
+        includes, imports – from its own folder) and the modification
+        times and sizes of the resources (e.g. fonts, images) referenced
+        in these templates by "url(...)" or "src=...".
+        """
+        folder = os.path.dirname(filepath)
+        stamp = []
+        seen = set()
+        todo = [filepath]
+        while todo:
+            path = todo.pop()
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                with open(path, 'rb') as fh:
+                    data = fh.read()
+            except FileNotFoundError:
+                stamp.append((path, None))
+                continue
+            stamp.append((path, hashlib.sha256(data).hexdigest()))
+            text = data.decode('utf-8', 'replace')
+            for name in re.findall(_TEMPLATE_REFS, text):
+                todo.append(os.path.join(folder, name))
+            for ref in re.findall(_RESOURCE_REFS, text):
+                if '{' in ref or ':' in ref:
+                    # A template expression or an absolute url
+                    continue
+                rpath = os.path.normpath(os.path.join(folder, ref))
+                if rpath in seen:
+                    continue
+                seen.add(rpath)
+                try:
+                    st = os.stat(rpath)
+                except FileNotFoundError:
+                    stamp.append((rpath, None))
+                    continue
+                stamp.append((rpath, st.st_mtime_ns, st.st_size))
+        return stamp
+
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + '.pdf')
+
+
+    def get(self, key):
+        """Return the cached pdf (<bytes>) for <key>, or <None>.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                pdf = fh.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return pdf
+
+
+    def put(self, key, pdf):
+        """Save the pdf (<bytes>) under <key>.
+        """
+        # Write to a temporary file first, so that an incomplete file is
+        # never visible under its final name.
+        fd, tmppath = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(pdf)
+            os.replace(tmppath, self._path(key))
+        except:
+            os.remove(tmppath)
+            raise
+
+
+    def sweep(self):
+        """Remove entries which have not been used recently. To avoid
+        scanning the folder every time a cache is opened, this is only
+        done if the last sweep (by any process) was more than
+        <_CACHE_SWEEP> seconds ago.
+        """
+        now = time.time()
+        sweepfile = os.path.join(self.folder, _CACHE_SWEEPFILE)
+        try:
+            if os.stat(sweepfile).st_mtime > now - _CACHE_SWEEP:
+                return
+        except FileNotFoundError:
+            pass
+        with open(sweepfile, 'w'):
+            pass
+        tmin = now - _CACHE_MAXAGE
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name == _CACHE_SWEEPFILE:
+                    continue
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < tmin:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    # Removed by another process
+                    pass
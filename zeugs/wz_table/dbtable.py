@@ -27,10 +27,15 @@ Copyright 2019 Michael Towers
 =-LICENCE========================================
 """
 
+# Version of the snapshot format, change when the format changes
+_SNAPSHOT_VERSION = 1
+
+import os, pickle, hashlib, tempfile
 from collections import UserList, OrderedDict
 
 from .spreadsheet import Spreadsheet
 from .spreadsheet_make import NewSpreadsheet
+from wz_core.timing import timed
 
 
 def dbTable(filepath, translate=None):
@@ -53,54 +58,177 @@ def dbTable(filepath, translate=None):
     return digestDBTable (table, translate)
 
 
+@timed('dbtable.read')
 def readDBTable (filepath):
     """<filepath> may be a string: path/to/spreadsheet ('.ods', '.xlsx').
     Alternatively, it may be a file object with attribute 'filename'.
+    If snapshots are enabled (see <_Snapshot>), the data for a file is
+    read from its snapshot, as long as the file is unchanged.
     """
+    snapshot = _Snapshot.get (filepath)
+    if snapshot:
+        rows = snapshot.load ()
+        if rows != None:
+            return rows
+    rows = _readDBTable (filepath)
+    if snapshot:
+        snapshot.save (rows)
+    return rows
+
+
+def _readDBTable (filepath):
     sheet = Spreadsheet (filepath, mustexist=False)
     rows = UserList ()
     rows.filepath = sheet.filepath
-    rows.title = sheet.getValue (0, 1)
+    rows.title = None
     rows.info = OrderedDict ()
 
+    def cell (i):
+        # The rows are not padded, so they can be short
+        try:
+            return row [i]
+        except IndexError:
+            return None
+
     headers = None
-    for rowix in range (sheet.colLen ()):
+    # Read the rows one by one, without loading the whole table
+    for rowix, row in enumerate (sheet.iterRows ()):
+        if rowix == 0:
+            rows.title = cell (1)
         # Get the value in the first column
-        entry1 = sheet.getValue (rowix, 0)
+        entry1 = cell (0)
         if not entry1:
             continue
         if headers == None:
             if entry1 == '#':
-                key = sheet.getValue (rowix, 1)
-                val = sheet.getValue (rowix, 2)
-                rows.info [key] = val
+                rows.info [cell (1)] = cell (2)
                 continue
 
             # Read the column headers from this line
             headers = OrderedDict ()
             rows.headers = OrderedDict ()
-            i, j = 0, 0
-            for cellix in range (sheet.rowLen ()):
-                h = sheet.getValue (rowix, cellix)
+            j = 0
+            for i, h in enumerate (row):
                 if h:
                     headers [h] = i
                     rows.headers [h] = j
                     j += 1
-                i += 1
             continue
 
         ### Read the row data
-        rowdata = []
-        for col in headers.values ():
-            try:
-                rowdata.append (sheet.getValue (rowix, col))
-            except:
-                rowdata.append (None)
-        rows.append (rowdata)
+        rows.append ([cell (col) for col in headers.values ()])
 
+    sheet.close ()
     return rows
 
 
+class _Snapshot:
+    """Manage a "snapshot" of the data read from a spreadsheet file.
+    This is saved (pickled) as a hidden file next to the spreadsheet,
+    stamped with the size, modification time and hash of the spreadsheet
+    file, and allows the table to be read much faster than by parsing
+    the spreadsheet. It is only used when the spreadsheet is unchanged.
+    Snapshots are enabled by a non-zero value for DBTABLE_SNAPSHOTS in
+    the configuration file MISC.
+    """
+    @classmethod
+    def get (cls, filepath):
+        """Return a <_Snapshot> instance for the given spreadsheet path,
+        or <None> if snapshots are disabled or the path is not a single
+        existing file.
+        """
+        if type (filepath) != str:
+            return None
+        enabled = CONF.MISC.get ('DBTABLE_SNAPSHOTS')
+        if not (enabled and enabled.nat ()):
+            return None
+        stamp = Spreadsheet.fileStamp (filepath)
+        if len (stamp) != 1:
+            return None
+        return cls (*stamp [0])
+
+
+    def __init__ (self, filepath, mtime, size):
+        self.filepath = filepath
+        self.mtime = mtime
+        self.size = size
+        d, f = os.path.split (filepath)
+        self.snappath = os.path.join (d, '.%s.dbtable' % f)
+        self._hash = None
+
+
+    def hash (self):
+        if self._hash == None:
+            with open (self.filepath, 'rb') as fh:
+                self._hash = hashlib.sha256 (fh.read ()).hexdigest ()
+        return self._hash
+
+
+    def load (self):
+        """Return the table data (as from <_readDBTable>), or <None> if
+        there is no valid snapshot.
+        """
+        try:
+            with open (self.snappath, 'rb') as fh:
+                data = pickle.load (fh)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Broken or incompatible file: build a new one
+            return None
+        if data.get ('version') != _SNAPSHOT_VERSION:
+            return None
+        if data ['size'] != self.size:
+            return None
+        if data ['mtime'] != self.mtime:
+            # Possibly just "touched" or copied
+            if data ['hash'] != self.hash ():
+                return None
+            self._write (data)
+        rows = UserList (data ['rows'])
+        rows.filepath = self.filepath
+        rows.title = data ['title']
+        rows.info = data ['info']
+        if data ['headers'] != None:
+            rows.headers = data ['headers']
+        return rows
+
+
+    def save (self, rows):
+        """Save the table data (as from <_readDBTable>).
+        """
+        self._write ({
+                'version': _SNAPSHOT_VERSION,
+                'size': self.size,
+                'mtime': self.mtime,
+                'hash': self.hash (),
+                'title': rows.title,
+                'info': rows.info,
+                'headers': getattr (rows, 'headers', None),
+                'rows': list (rows)
+            })
+
+
+    def _write (self, data):
+        data ['mtime'] = self.mtime
+        try:
+            # Write to a temporary file first, so that an incomplete file
+            # is never visible under the final name.
+            fd, tmppath = tempfile.mkstemp (
+                    dir=os.path.dirname (self.snappath), suffix='.tmp')
+        except OSError:
+            # The folder is not writeable, the snapshot is not essential
+            return
+        try:
+            with os.fdopen (fd, 'wb') as fh:
+                pickle.dump (data, fh, pickle.HIGHEST_PROTOCOL)
+            os.replace (tmppath, self.snappath)
+        except:
+            os.remove (tmppath)
+            raise
+
+
+
 def digestDBTable (table, translate=None):
     """Process the data from a dbtable, returning an ordered mapping:
         {[ordered] key -> {field: value}}.
@@ -10,6 +10,13 @@ OdsReader:
 Read the data from the sheets of an ods file ignoring all formatting/style information.
 The content is found in the file "content.xml".
 
+OdsRows:
+Read the rows of a single sheet incrementally.
+
+The parser state is held in the instances, so several files can be
+parsed at the same time (e.g. in different threads). The content file is
+fed to the parser in chunks, so it is never held in memory as a whole.
+
 =+LICENCE=============================
 Copyright 2017-2018 Michael Towers
 
@@ -30,241 +37,336 @@ Copyright 2017-2018 Michael Towers
 
 import zipfile as zf
 import io as si
-import re
 
 #TODO ...
 # Add option to ignore content of covered cells?
 
 _odsContentFile = 'content.xml'
-_debug = False
 
 from xml.parsers.expat import ParserCreate
 
 
-class OdsReader:
+class _OdsParser:
     """Uses the expat parser to get at the tables and their data.
     All formatting information is ignored.
-    An xml string is parsed to a table of cell values.
+    The rows of the sheets are collected in <self._out> in a compact
+    form, in which repeated rows and cells are not expanded:
+        (index of first row, number of rows, cells),
+    where cells is a list of
+        (index of first cell, number of cells, cell value).
+    A cell value is a tuple (type, value, text, formula). Empty rows
+    and cells are not included. See <expandRow>.
+    Subclasses decide which sheets are to be read (<_wantSheet>) and
+    handle the rows (<_endSheet>, or by taking them from <self._out>
+    while parsing, see <_parse>).
 
     Note that the expat parser converts all items to unicode.
 
     An instance of the expat parser can only handle a single file, so
     a new instance must be created for each file to be parsed.
     """
-    no_covered_cells = None    # Set to <True> to read all covered cells as empty
-    _sheets = None
-    _rows = None
-    _rowcount = None
-    _rowrepeat = None
-    _cells = None
-    _ncols = None
-    _cellcount = None
-    _celltype = None
-    _repeat = None
-    _value = None
-    _paras = None
-    _text = None
-    _mergeList = None
-    _merge = None
+    CHUNKSIZE = 0x10000
 
-    @classmethod
-    def parseXML (cls, xmldata):
-        parser = ParserCreate ()
+    def __init__ (self, ignoreCoveredCells=False):
+        # Set <ignoreCoveredCells> to <True> to read all covered cells
+        # as empty
+        self.no_covered_cells = ignoreCoveredCells
+        self.sheetname = None
+        self.mergeList = None
+        self._active = False    # parsing a sheet which is to be read
+        self._done = False      # no further sheets are to be read
+        self._out = []          # completed rows
+        self._cells = None
+        self._celltype = None
+        self._text = None
+        self._paras = None
 
-        parser.StartElementHandler = cls._start_element
-        parser.EndElementHandler = cls._end_element
-        parser.CharacterDataHandler = cls._char_data
 
-        cls._sheets = None
-        parser.Parse (xmldata)
-        return cls._sheets
+    def _wantSheet (self, sheetname):
+        return True
 
 
-    @classmethod
-    def show (cls, *args):
-        if _debug:
-            print (*args)
+    def _endSheet (self):
+        pass
 
 
-    @classmethod
-    def _cellStart (cls, attrs):
-        assert cls._celltype == None
-        cls._paras = []
-        cls._formula = attrs.get ('table:formula')
-        cls._celltype = attrs.get ('office:value-type')
-        if cls._celltype == None:
-            # Empty cells are handled specially because there can be a
-            # very large number of these at the end of a row
-            cls._celltype = '__EMPTY__'
-            cls._value = None
-        elif cls._celltype in ('float', 'percentage', 'currency'):
-            value = attrs.get ('office:value')
-            if value == None:
-                cls._value = None
-            else:
-                cls._value = float (value)
-        elif cls._celltype == 'string':
-            cls._value = attrs.get ('office:string-value')
-        elif cls._celltype == 'boolean':
-            value = attrs.get ('office:boolean-value')
-            if value == 'true':
-                cls._value = True
-            else:
-                assert value == 'false'
-                cls._value = False
-        elif cls._celltype == 'date':
-            cls._value = attrs.get ('office:date-value')
-        elif cls._celltype == 'time':
-            cls._value = attrs.get ('office:time-value')
-        else:
-            print ("ERROR: unknown cell type:", cls._celltype)
-            assert False
+    def _parse (self, fh):
+        """Parse the xml file (file object) <fh>, feeding it to the parser
+        in chunks. This is a generator, it yields after each chunk.
+        """
+        parser = ParserCreate ()
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._char_data
+        while not self._done:
+            data = fh.read (self.CHUNKSIZE)
+            parser.Parse (data, not data)
+            yield
+            if not data:
+                break
+
+
+    def _parseOds (self, filepath):
+        """Parse the content file of the ods file <filepath> (path or file
+        object). This is a generator, see <_parse>.
+        """
+        with zf.ZipFile (filepath) as zipfile:
+            with zipfile.open (_odsContentFile) as fh:
+                yield from self._parse (fh)
 
 
     ############ 3 handler functions ############
 
-    @classmethod
-    def _start_element(cls, name, attrs):
-        cls.show ('>>> Start element:', name, attrs)
+    def _start_element (self, name, attrs):
+        if name == 'table:table':
+            if self._done or not self._wantSheet (attrs ['table:name']):
+                return
+            self.sheetname = attrs ['table:name']
+            self._active = True
+            self._rowcount = 0      # rows read, including empty ones
+            self.mergeList = []
+            return
+        if not self._active:
+            return
         if name == 'table:table-cell' or name == 'table:covered-table-cell':
-            cls._repeat = int (attrs.get ("table:number-columns-repeated", 1))
-            cls._cellStart (attrs)
+            self._repeat = int (attrs.get ("table:number-columns-repeated", 1))
             # Note merge information
-            cls._merge = (attrs.get ('table:number-rows-spanned'),
+            self._merge = (attrs.get ('table:number-rows-spanned'),
                     attrs.get ('table:number-columns-spanned'))
+            self._paras = []
+            self._formula = attrs.get ('table:formula')
+            self._celltype, self._value = _cellType (attrs)
 
         elif name == 'text:p':
-            assert cls._text == None
-            cls._text = ""
+            self._text = ""
 
         elif name == 'table:table-row':
-            assert cls._cells == None
-            cls._cellcount = 0
-            cls._cells = []
-            cls._rowrepeat = int (attrs.get ("table:number-rows-repeated", 1))
-
-        elif name == 'table:table':
-            assert cls._rows == None
-            cls._sheetname = attrs ['table:name']
-            cls.show ('\n    --- sheet name: %s\n' % cls._sheetname)
-            cls._rows = []
-            cls._rowcount = 0
-            cls._mergeList = []
-            cls._ncols = 0
-
-        elif name == 'office:spreadsheet':
-            assert cls._sheets == None
-            cls._sheets = []
+            self._cellcount = 0
+            self._cells = []
+            self._rowrepeat = int (attrs.get ("table:number-rows-repeated", 1))
 
 
-    @classmethod
-    def _end_element(cls, name):
-        cls.show ('>>> End element:', name)
+    def _end_element (self, name):
+        if not self._active:
+            return
         if name == 'table:table-cell' or name == 'table:covered-table-cell':
             # Retrieve merge information
-            rs, cs = cls._merge
+            rs, cs = self._merge
             # Check whether this is the main cell of a merged range
             if rs or cs:
-                cls._mergeList.append ((cls._rowcount, cls._cellcount,
+                self.mergeList.append ((self._rowcount, self._cellcount,
                         int (rs or 1), int (cs or 1)))
 
-            if cls._celltype == '__EMPTY__' and cls._formula != None:
-                # Don't count formula cells as empty, even if there is no value,
-                # but mark them as empty untyped.
-                cls._celltype = None
-
-            if name == 'table:covered-table-cell' and cls.no_covered_cells:
-                cls._celltype = '__EMPTY__'
+            if self._celltype == '__EMPTY__' and self._formula != None:
+                # Don't count formula cells as empty, even if there is no
+                # value, but mark them as empty untyped.
+                self._celltype = None
 
-            if cls._celltype != '__EMPTY__':
-                # Add skipped empty cells
-                while len (cls._cells) < cls._cellcount:
-                    # Add an empty cell
-                    cls._cells.append (None)
+            if name == 'table:covered-table-cell' and self.no_covered_cells:
+                self._celltype = '__EMPTY__'
 
-                val = (cls._celltype, cls._value, "\n".join (cls._paras), cls._formula)
-                for i in range (cls._repeat):
-                    cls._cells.append (val)
+            if self._celltype != '__EMPTY__':
+                val = (self._celltype, self._value, "\n".join (self._paras),
+                        self._formula)
+                self._cells.append ((self._cellcount, self._repeat, val))
 
-            #else:
-                # Don't add any cells yet. Wait to see if there are any
-                # non-empty calls afterwards.
-
-            cls._cellcount += cls._repeat
-            cls._celltype = None
-            cls._repeat = None
-            cls._paras = None
+            self._cellcount += self._repeat
+            self._celltype = None
+            self._paras = None
 
         elif name == 'text:p':
-            assert cls._text != None
-            if cls._paras != None:
-                cls._paras.append (cls._text)
-            cls._text = None
+            if self._paras != None:
+                self._paras.append (self._text)
+            self._text = None
 
         elif name == 'table:table-row':
-            if cls._cells:
-                # The row is not empty: add skipped empty rows
-                while len (cls._rows) < cls._rowcount:
-                    # Add an empty row
-                    cls._rows.append ([])
+            if self._cells:
+                self._out.append ((self._rowcount, self._rowrepeat,
+                        self._cells))
+            self._rowcount += self._rowrepeat
+            self._cells = None
 
-                for i in range (cls._rowrepeat):
-                    cls._rows.append (cls._cells)
+        elif name == 'table:table':
+            self._active = False
+            self._endSheet ()
 
-                nc = len (cls._cells)
-                if nc > cls._ncols:
-                    cls._ncols = nc
 
-            # else:
-            #     Don't add any rows yet. Wait to see if there are any
-            #     non-empty rows afterwards.
+    def _char_data (self, data):
+        # Only within a paragraph of a sheet which is being read is
+        # <self._text> not <None>. This method can also be called at
+        # other places, where the data is of no interest.
+        if self._text != None:
+            self._text += data
 
-            cls._rowcount += cls._rowrepeat
-            cls._cells = None
+    ############ end handler functions ############
 
-        elif name == 'table:table':
-            # Equalise the row lengths
-            for row in cls._rows:
-                while len (row) < cls._ncols:
-                    row.append (None)
 
-            cls._sheets.append ((cls._sheetname, cls._rows, cls._mergeList))
-            cls._sheetname = None
-            cls._rows = None
-            cls._rowcount = None
-            cls._mergeList = None
 
+class OdsReader (_OdsParser):
+    """Read all the sheets of an ods file (or the content xml).
+    The result is a list of sheets: [(name, rows, merged ranges), ...].
+    The rows of a sheet all have the same length (padded with <None>).
+    """
+    def __init__ (self, ignoreCoveredCells=False):
+        super ().__init__ (ignoreCoveredCells)
+        self.sheets = []
 
-    @classmethod
-    def _char_data(cls, data):
-        cls.show ('>>> Character data:', type (data), repr(data))
-        if cls._sheets != None:
-            # Only while parsing the data of a sheet is <cls._text> not <None>
-            # but this method can also be called at other places, where
-            # the data is of no interest.
-            cls._text += data
 
-    ############ end handler functions ############
+    def _endSheet (self):
+        # Expand the rows, equalising their lengths
+        ncols = rowLength (self._out)
+        rows = []
+        for start, n, cells in self._out:
+            while len (rows) < start:
+                rows.append ([None] * ncols)
+            rows += [expandRow (cells, ncols)] * n
+        self.sheets.append ((self.sheetname, rows, self.mergeList))
+        self._out = []
+
+
+    def _read (self, parsing):
+        for _ in parsing:
+            pass
+        return self.sheets
+
+
+    @classmethod
+    def parseXML (cls, xmldata):
+        reader = cls ()
+        return reader._read (reader._parse (si.BytesIO (xmldata)))
 
 
     @classmethod
     def readOdsFile (cls, filepath, ignoreCoveredCells=False):
-        cls.no_covered_cells = ignoreCoveredCells
-        xmldata = cls._getOdsContent (filepath)
-        return cls.parseXML (xmldata)
+        reader = cls (ignoreCoveredCells)
+        return reader._read (reader._parseOds (filepath))
+
+
+    @classmethod
+    def readFile (cls, xmlfile):
+        reader = cls ()
+        with open (xmlfile, "rb") as fi:
+            return reader._read (reader._parse (fi))
+
+
+
+class OdsRows (_OdsParser):
+    """Read the rows of a single sheet of an ods file incrementally.
+    The content file is fed to the expat parser in chunks and the rows
+    are delivered as they are completed, so that only the current chunk
+    and the pending rows are held in memory. Parsing stops at the end of
+    the requested sheet.
+    Iterating over an instance produces the rows, each a list of cells
+    as from <OdsReader>. The rows are not padded, empty rows are empty
+    lists. Alternatively, <runs> produces the rows in compact form (see
+    <_OdsParser>).
+    The merged ranges of the sheet are available as <mergeList> after
+    the iteration.
+    An instance can only be iterated once.
+    """
+    def __init__ (self, filepath, sheetname=None, ignoreCoveredCells=False):
+        """<filepath> may be a path or a (seekable) file object.
+        If <sheetname> is not given, the first sheet is read.
+        """
+        super ().__init__ (ignoreCoveredCells)
+        self.filepath = filepath
+        self.sheetname = sheetname
 
 
     @staticmethod
-    def _getOdsContent (filepath):
-        """Returns the content xml file – I assume always bytes encoded as utf-8.
+    def sheetNames (filepath):
+        """Return a list of the names of the sheets in the given file.
         """
+        names = []
+        def start (name, attrs):
+            if name == 'table:table':
+                names.append (attrs ['table:name'])
+        parser = ParserCreate ()
+        parser.StartElementHandler = start
         with zf.ZipFile (filepath) as zipfile:
-            xmlbytes = zipfile.read (_odsContentFile)
-        return xmlbytes
+            with zipfile.open (_odsContentFile) as fh:
+                parser.ParseFile (fh)
+        return names
 
 
-    @classmethod
-    def readFile (cls, xmlfile):
-        with open (xmlfile, "rb") as fi:
-            xmldata = fi.read ()
-        return cls.parseXML (xmldata)
+    def _wantSheet (self, sheetname):
+        return self.sheetname == None or sheetname == self.sheetname
+
+
+    def _endSheet (self):
+        self._done = True
+
+
+    def runs (self):
+        """Iterate over the rows in compact form (see <_OdsParser>).
+        """
+        for _ in self._parseOds (self.filepath):
+            if self._out:
+                yield from self._out
+                self._out = []
+        if not self._done:
+            raise KeyError (self.sheetname)
+
+
+    def __iter__ (self):
+        i = 0
+        for start, n, cells in self.runs ():
+            while i < start:
+                yield []
+                i += 1
+            row = expandRow (cells)
+            for _ in range (n):
+                yield row
+            i = start + n
+
+
+
+def expandRow (cells, ncols=0):
+    """Return the row (list) for the compact cell list <cells> (see
+    <_OdsParser>), empty cells being <None>. If <ncols> is given, the
+    row is padded to this length.
+    """
+    row = []
+    for start, n, val in cells:
+        if len (row) < start:
+            row += [None] * (start - len (row))
+        row += [val] * n
+    if len (row) < ncols:
+        row += [None] * (ncols - len (row))
+    return row
+
+
+def rowLength (rows):
+    """Return the length of the longest row in the list of compact rows
+    <rows> (see <_OdsParser>).
+    """
+    ncols = 0
+    for start, n, cells in rows:
+        c, k, val = cells [-1]
+        if c + k > ncols:
+            ncols = c + k
+    return ncols
+
+
+def _cellType (attrs):
+    """Return the type and value of a cell from the attributes of its
+    xml element: (type, value). Empty cells have type '__EMPTY__'.
+    """
+    celltype = attrs.get ('office:value-type')
+    if celltype == None:
+        return ('__EMPTY__', None)
+    if celltype in ('float', 'percentage', 'currency'):
+        value = attrs.get ('office:value')
+        return (celltype, None if value == None else float (value))
+    if celltype == 'string':
+        return (celltype, attrs.get ('office:string-value'))
+    if celltype == 'boolean':
+        value = attrs.get ('office:boolean-value')
+        assert value in ('true', 'false')
+        return (celltype, value == 'true')
+    if celltype == 'date':
+        return (celltype, attrs.get ('office:date-value'))
+    if celltype == 'time':
+        return (celltype, attrs.get ('office:time-value'))
+    print ("ERROR: unknown cell type:", celltype)
+    assert False
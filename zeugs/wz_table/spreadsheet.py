@@ -47,62 +47,276 @@ _NO_TYPE_EXTENSION      = "Dateityp-Erweiterung fehlt: {fname}"
 
 
 import os, datetime
-from collections import OrderedDict
+from xml.etree import ElementTree
+from bisect import bisect_right
+from collections.abc import Mapping
 
 from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
-from .simpleods import OdsReader
+from openpyxl.utils import get_column_letter, range_boundaries
+from .simpleods import OdsRows, expandRow, rowLength
+
+_XLS_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_XLS_MERGECELL = _XLS_NS + 'mergeCell'
+_XLS_ROW = _XLS_NS + 'row'
+
+
+class _Sheets (Mapping):
+    """A mapping {sheet name -> row list} whose sheets are only read when
+    they are first accessed. <names> is a list of the sheet names, or
+    a function returning this list. <load> is a function taking a sheet
+    name and returning its rows.
+    """
+    def __init__ (self, names, load):
+        self._names = names
+        self._load = load
+        self._sheets = {}
+
+    def names (self):
+        if callable (self._names):
+            self._names = self._names ()
+        return self._names
+
+    def __getitem__ (self, sheetname):
+        try:
+            return self._sheets [sheetname]
+        except KeyError:
+            pass
+        # An unknown sheet name causes a <KeyError>
+        rows = self._load (sheetname)
+        self._sheets [sheetname] = rows
+        return rows
+
+    def __iter__ (self):
+        return iter (self.names ())
+
+    def __len__ (self):
+        return len (self.names ())
+
+
+def _padRows (rows, ncols=0):
+    """Extend the rows of a table (in place) to the same length, at least
+    <ncols>.
+    """
+    ncols = max (ncols, max ((len (row) for row in rows), default=0))
+    for row in rows:
+        if len (row) < ncols:
+            row += [None] * (ncols - len (row))
+    return rows
+
+
+
+class RunLengthSheet:
+    """A read-only table in which repeated rows and cells are stored only
+    once (as in ods files). It is built from a list of "compact" rows
+    (see <simpleods._OdsParser>) and behaves like a list of rows, all
+    having the same length, but the rows are only built when accessed.
+    Single values can be read without building the rows, using <value>.
+    """
+    def __init__ (self, rows):
+        self._rows = rows
+        self._starts = [start for start, n, cells in rows]
+        # The start indexes of the cell runs in each row
+        self._cstarts = [[c for c, k, val in cells]
+                for start, n, cells in rows]
+        if rows:
+            start, n, cells = rows [-1]
+            self._nrows = start + n
+        else:
+            self._nrows = 0
+        self._ncols = rowLength (rows)
+
+    def __len__ (self):
+        return self._nrows
+
+    def value (self, rx, cx):
+        """Return the value of the cell at row <rx>, column <cx>.
+        """
+        if not (0 <= rx < self._nrows and 0 <= cx < self._ncols):
+            raise IndexError
+        i = bisect_right (self._starts, rx) - 1
+        if i < 0:
+            return None
+        start, n, cells = self._rows [i]
+        if rx >= start + n:
+            return None
+        j = bisect_right (self._cstarts [i], cx) - 1
+        if j < 0:
+            return None
+        c, k, val = cells [j]
+        return val if cx < c + k else None
+
+    def __getitem__ (self, rx):
+        if rx < 0:
+            rx += self._nrows
+        if not 0 <= rx < self._nrows:
+            raise IndexError
+        i = bisect_right (self._starts, rx) - 1
+        if i >= 0:
+            start, n, cells = self._rows [i]
+            if rx < start + n:
+                return expandRow (cells, self._ncols)
+        return [None] * self._ncols
+
+    def __iter__ (self):
+        i = 0
+        for start, n, cells in self._rows:
+            while i < start:
+                yield [None] * self._ncols
+                i += 1
+            row = expandRow (cells, self._ncols)
+            for _ in range (n):
+                yield row
+            i = start + n
+
 
 
 class XLS_spreadsheet:
     def __init__ (self, filepath):
         """Read an Excel spreadsheet as a list of rows,
         each row is a list of cell values.
-        All sheets in the file are read, an 'OrderedDict' of sheets
-        (name -> row list) is built.
+        The sheets are available as an ordered mapping (name -> row list),
+        <sheets>, but a sheet is only read when it is first accessed.
+        Alternatively, the rows of a sheet can be read one at a time,
+        using <iterRows>.
 
         This is a read-only utility. Formulae, style, etc. are not retained.
         For formulae the last-calculated value is returned.
         All values are returned as strings.
+        The cells covered by a merged range are empty, only the top-left
+        cell of the range has a value.
         """
-        sheets = OrderedDict ()
-        self._mergedRanges = OrderedDict ()
         # Note that <data_only=True> replaces all formulae by their value,
         # which is probably good for reading, but not for writing!
-        wb = load_workbook (filepath, data_only=True)
-        for wsname in wb.sheetnames:
-            ws = wb [wsname]
-            rows = []
-            for row in ws.iter_rows ():
-                values = []
-                for cell in row:
-                    v = cell.value
-                    if type (v) == datetime.datetime:
-                        v = v.strftime ("%Y-%m-%d")
-                    elif type (v) == str:
-                        v = v.strip ()
-                        if v == '':
-                             v = None
-                    elif v != None:
-                        v = str (v)
-                    values.append (v)
-                rows.append (values)
-            sheets[wsname] = rows
-            self._mergedRanges [wsname] = ws.merged_cells.ranges
-        self.sheets = sheets
+        # <read_only=True> allows the rows to be read incrementally.
+        self._wb = load_workbook (filepath, read_only=True, data_only=True)
+        self._sheetnames = self._wb.sheetnames
+        self._mergedRanges = {}
+        self.sheets = _Sheets (self._sheetnames, self._loadSheet)
+
+    def close (self):
+        """Close the file. This happens automatically when all sheets
+        have been read.
+        """
+        if self._wb != None:
+            self._wb.close ()
+            self._wb = None
+
+    def _worksheet (self, sheetname):
+        if sheetname not in self._sheetnames:
+            raise KeyError (sheetname)
+        ws = self._wb [sheetname]
+        # The size declared in the file is often far too large (e.g.
+        # 1048576 rows from LibreOffice), so only the actual rows are read.
+        ws.reset_dimensions ()
+        return ws
+
+    def _loadSheet (self, sheetname):
+        rows = list (self.iterRows (sheetname))
+        if len (self.sheets._sheets) + 1 == len (self._sheetnames):
+            # This is the last sheet to be read
+            self.close ()
+        ncols = max ((c2 for r1, c1, r2, c2 in self._merges (sheetname)),
+                default=0)
+        return _padRows (rows, ncols)
+
+    def firstSheet (self):
+        """Return the name of the first sheet.
+        """
+        return self._sheetnames [0]
+
+    def iterRows (self, sheetname):
+        """Return an iterator over the rows of the given sheet. Each row
+        is a list of cell values. The rows are not padded to the same
+        length. Trailing empty rows are not returned.
+        """
+        rows = self.sheets._sheets.get (sheetname)
+        if rows != None:
+            # Already read (the file may be closed)
+            yield from rows
+            return
+        merges = self._merges (sheetname)
+        # Collect the covered cells of the merged ranges, as
+        # {row index: [(first col, last col), ...]} (0-based, inclusive)
+        covered = {}
+        for r1, c1, r2, c2 in merges:
+            covered.setdefault (r1 - 1, []).append ((c1, c2 - 1))
+            for r in range (r1, r2):
+                covered.setdefault (r, []).append ((c1 - 1, c2 - 1))
+        # In the full model, the merged ranges are part of the table
+        nrows = max ((r2 for r1, c1, r2, c2 in merges), default=0)
+        empty = 0       # pending empty rows
+        rowix = 0
+        for row in self._worksheet (sheetname).iter_rows (values_only=True):
+            if not row and rowix >= nrows:
+                # An empty row is only returned if more rows follow
+                empty += 1
+                rowix += 1
+                continue
+            while empty:
+                yield []
+                empty -= 1
+            values = [_xlsValue (v) for v in row]
+            for ca, cb in covered.get (rowix, ()):
+                for c in range (ca, min (cb + 1, len (values))):
+                    values [c] = None
+            yield values
+            rowix += 1
+        while rowix < nrows:
+            yield []
+            rowix += 1
+
+    def _merges (self, sheetname):
+        """Return a list of the merged ranges of the given sheet as
+        (min row, min col, max row, max col) tuples (1-based).
+        The merged ranges are only available in openpyxl's "full" mode,
+        so they are read separately from the sheet's xml, without building
+        the whole table.
+        """
+        try:
+            return self._mergedRanges [sheetname]
+        except KeyError:
+            pass
+        merges = []
+        with self._worksheet (sheetname)._get_source () as src:
+            for event, elem in ElementTree.iterparse (src,
+                    events = ('start', 'end')):
+                if event == 'start':
+                    if elem.tag == _XLS_MERGECELL:
+                        c1, r1, c2, r2 = range_boundaries (elem.get ('ref'))
+                        merges.append ((r1, c1, r2, c2))
+                elif elem.tag == _XLS_ROW:
+                    # Don't keep the rows in memory
+                    elem.clear ()
+        self._mergedRanges [sheetname] = merges
+        return merges
 
     def mergedRanges (self, sheetname):
         """Returns a list like ['AK2:AM2', 'H33:AD33', 'I34:J34', 'L34:AI34'].
         """
-        return self._mergedRanges [sheetname]
+        return ["%s%d:%s%d" % (get_column_letter (c1), r1,
+                        get_column_letter (c2), r2)
+                for r1, c1, r2, c2 in self._merges (sheetname)]
+
+
+def _xlsValue (v):
+    if type (v) == datetime.datetime:
+        return v.strftime ("%Y-%m-%d")
+    if type (v) == str:
+        return v.strip () or None
+    if v != None:
+        return str (v)
+    return None
+
 
 
 class ODS_spreadsheet:
     def __init__ (self, filepath):
         """Read an ".ods" (LibreOffice) spreadsheet as a list of rows,
         each row is a list of cell values.
-        All sheets in the file are read, an 'OrderedDict' of sheets
-        (name -> row list) is built.
+        The sheets are available as an ordered mapping (name -> row list),
+        <sheets>, but a sheet is only read when it is first accessed.
+        Alternatively, the rows of a sheet can be read one at a time,
+        using <iterRows>.
 
         This is a read-only utility. Formulae, style, etc. are not retained.
         For formulae the last-calculated value is returned.
@@ -110,41 +324,55 @@ class ODS_spreadsheet:
         Numbers which can be represented as integers (xxxx.0) are returned
         as integers (in string form).
         """
-        # Read the file to a list form (see <OdsReader>)
-        sheets = OdsReader.readOdsFile (filepath)
-        # Extract the needed data in the form specified above
-        self.sheets = OrderedDict ()
-        self._mergedRanges = OrderedDict ()
-        for sheetname, rows, mergelist in sheets:
-            rowlist = []
-            for row in rows:
-                cells = []
-                for cell in row:
-                    if cell == None:
-                        cells.append (None)
-                    else:
-                        ctype, cval, ctext, cformula = cell
-                        if ctype == None:
-                            v = None
-                        elif ctype == 'string':
-                            v = ctext.strip ()
-                            if v == '':
-                                v = None
-                        elif ctype == 'float':
-                            # Fix for integers returned as floats
-                            i = int (cval)
-                            v = str (i if i == cval else cval)
-                        else:
-                            v = str (cval)
-                        cells.append (v)
-                rowlist.append (cells)
-            self.sheets [sheetname] = rowlist
-            self._mergedRanges [sheetname] = mergelist
+        self._filepath = filepath
+        self._mergedRanges = {}
+        self.sheets = _Sheets (self._sheetNames, self._loadSheet)
 
+    def close (self):
+        """The file is only open while it is being read.
+        """
+        pass
+
+    def _reader (self, sheetname):
+        if not isinstance (self._filepath, str):
+            self._filepath.seek (0)
+        return OdsRows (self._filepath, sheetname)
+
+    def _sheetNames (self):
+        if not isinstance (self._filepath, str):
+            self._filepath.seek (0)
+        return OdsRows.sheetNames (self._filepath)
+
+    def _loadSheet (self, sheetname):
+        reader = self._reader (sheetname)
+        # Convert the values, keeping the compact form
+        rows = [(start, n, [(c, k, _odsValue (val))
+                        for c, k, val in cells])
+                for start, n, cells in reader.runs ()]
+        self._mergedRanges [sheetname] = reader.mergeList
+        return RunLengthSheet (rows)
+
+    def firstSheet (self):
+        """Return the name of the first sheet, without reading the whole
+        file.
+        """
+        reader = self._reader (None)
+        for row in reader:
+            break
+        return reader.sheetname
+
+    def iterRows (self, sheetname):
+        """Return an iterator over the rows of the given sheet. Each row
+        is a list of cell values. The rows are not padded to the same
+        length.
+        """
+        for row in self._reader (sheetname):
+            yield [_odsValue (cell) for cell in row]
 
     def mergedRanges (self, sheetname):
         """Returns a list like ['AK2:AM2', 'H33:AD33', 'I34:J34', 'L34:AI34'].
         """
+        self.sheets [sheetname]     # make sure the sheet has been read
         mrlist = []
         for mr in self._mergedRanges [sheetname]:
             # (rcount, ccount, rs or 1, cs or 1) -> "A2:B4" (for example)
@@ -156,6 +384,21 @@ class ODS_spreadsheet:
         return mrlist
 
 
+def _odsValue (cell):
+    if cell == None:
+        return None
+    ctype, cval, ctext, cformula = cell
+    if ctype == None:
+        return None
+    if ctype == 'string':
+        return ctext.strip () or None
+    if ctype == 'float':
+        # Fix for integers returned as floats
+        i = int (cval)
+        return str (i if i == cval else cval)
+    return str (cval)
+
+
 
 class Spreadsheet:
     """This class manages a (read-only) representation of a spreadsheet file.
@@ -166,6 +409,8 @@ class Spreadsheet:
     Row length and column length are available via the methods rowLen() and colLen().
     The value of a cell is read using <getValue(row, col)>, where <row> and <col> are
     0-based indexes.
+    A sheet is only read from the file when it is first accessed. If only the
+    rows in sequence are needed, <iterRows()> reads them one at a time.
     All cell values are strings, or <None> if empty.
     """
     _SUPPORTED_TYPES = {'ods': ODS_spreadsheet, 'xlsx': XLS_spreadsheet}
@@ -182,6 +427,27 @@ class Spreadsheet:
         return False
 
 
+    @classmethod
+    def fileStamp (cls, filepath):
+        """Return a value which changes when the spreadsheet file
+        <filepath> (with or without type-extension) is changed: a tuple
+        of (path, modification time, size) for each matching file.
+        This can be used to check the validity of cached data.
+        """
+        if cls.supportedType (filepath):
+            paths = [filepath]
+        else:
+            paths = ['%s.%s' % (filepath, e) for e in cls._SUPPORTED_TYPES]
+        stamp = []
+        for fp in paths:
+            try:
+                st = os.stat (fp)
+            except FileNotFoundError:
+                continue
+            stamp.append ((fp, st.st_mtime_ns, st.st_size))
+        return tuple (stamp)
+
+
     def __init__ (self, filepath, mustexist=True):
         """The filepath can be passed with or without type-extension.
         If no type-extension is given, the folder will be searched for a
@@ -251,23 +517,59 @@ class Spreadsheet:
             # Error: couldn't read file
             REPORT.Fail (_TABLENOTREADABLE, path=self.filepath or fname)
 
-        self._sheetNames = list (self._spreadsheet.sheets)
-        # Default sheet is the first:
-        self._table = self._spreadsheet.sheets [self._sheetNames [0]]
+        # The sheets are only read when needed. The default sheet is the
+        # first.
+
+    def close (self):
+        """Release the file, if it is still open. The sheets which have
+        already been read remain available.
+        """
+        self._spreadsheet.close ()
+
+    def _currentTable (self):
+        if self._table == None:
+            self._table = self._spreadsheet.sheets [self._firstSheet ()]
+        return self._table
+
+    def _firstSheet (self):
+        if self._sheetNames != None:
+            return self._sheetNames [0]
+        return self._spreadsheet.firstSheet ()
+
+    def iterRows (self, tablename = None):
+        """Return an iterator over the rows of a sheet – by default the
+        current one. Each row is a list of cell values. The rows are read
+        one by one from the file (unless the sheet has already been read),
+        so that large tables can be processed without holding all the
+        data in memory. Note that the rows need not all have the same
+        length.
+        """
+        if tablename == None:
+            if self._table != None:
+                yield from self._table
+                return
+            tablename = self._firstSheet ()
+        try:
+            yield from self._spreadsheet.iterRows (tablename)
+        except KeyError:
+            REPORT.Fail (_INVALIDSHEETNAME, name=tablename)
 
     def rowLen (self, table = None):
         if not table:
-            table = self._table
+            table = self._currentTable ()
         return len (table [0])
 
     def colLen (self, table = None):
         if not table:
-            table = self._table
+            table = self._currentTable ()
         return len (table)
 
     def getValue (self, rx, cx, table = None):
         if not table:
-            table = self._table
+            table = self._currentTable ()
+        if isinstance (table, RunLengthSheet):
+            # Avoid building the row
+            return table.value (rx, cx)
         return table [rx] [cx]
 
     def getABValue (self, A1, table = None):
@@ -275,6 +577,8 @@ class Spreadsheet:
         return self.getValue (r, c, table)
 
     def getTableNames (self):
+        if self._sheetNames == None:
+            self._sheetNames = list (self._spreadsheet.sheets)
         return self._sheetNames
 
     def _getTable (self, tablename, failerror=True):
@@ -345,3 +649,36 @@ class Spreadsheet:
         """Return the name of a cell given its coordinates (0-based):
         """
         return get_column_letter (col+1) + str (row+1)
+
+
+
+def test_01 ():
+    """Compare the xlsx reader with the original one (which read the
+    whole file using openpyxl's "full" mode) on all xlsx files in the
+    data folder.
+    """
+    from glob import glob
+    from wz_core.configuration import Paths
+    from .spreadsheet0 import XLS_spreadsheet as XLS_full
+
+    def strip (row):
+        row = list (row)
+        while row and row [-1] == None:
+            row.pop ()
+        return row
+
+    for f in sorted (glob (Paths.getUserFolder ('**', '*.xlsx'),
+            recursive=True)):
+        old = XLS_full (f)
+        new = XLS_spreadsheet (f)
+        for sheetname, rows in old.sheets.items ():
+            if ([strip (row) for row in new.iterRows (sheetname)]
+                    != [strip (row) for row in rows]):
+                REPORT.Fail ("Rows differ: %s [%s]" % (f, sheetname))
+            if new.sheets [sheetname] != rows:
+                REPORT.Fail ("Sheets differ: %s [%s]" % (f, sheetname))
+            if (sorted (new.mergedRanges (sheetname))
+                    != sorted (str (mr) for mr in old.mergedRanges (sheetname))):
+                REPORT.Fail ("Merged ranges differ: %s [%s]" % (f, sheetname))
+        new.close ()
+        REPORT.Test ("OK: %s" % f)
@@ -33,13 +33,11 @@ _BADPID             = "Schüler {pid} nicht in Klasse {klass}"
 
 import os
 
-from weasyprint import HTML, CSS
-from weasyprint.fonts import FontConfiguration
-
 from wz_core.configuration import Paths, Dates
 from wz_core.pupils import Pupils, Klass
 from wz_compat.config import printSchoolYear
 from wz_compat.template import getTextTemplate, getTemplateTags, pupilFields
+from wz_io.htmlpdf import html2pdf
 
 
 def makeSheets (schoolyear, date, klass, pids=None):
@@ -76,10 +74,7 @@ def makeSheets (schoolyear, date, klass, pids=None):
         )
 
     if plist:
-        html = HTML (string=source,
-                base_url=os.path.dirname (template.filename))
-        pdfBytes = html.write_pdf(font_config=FontConfiguration())
-        return pdfBytes
+        return html2pdf(source, os.path.dirname (template.filename))
     else:
         REPORT.Fail(_NOPUPILS)
 
@@ -100,10 +95,7 @@ def makeOneSheet(schoolyear, date, klass, pupil):
             pupils = [pupil],
             klass = klass
         )
-    html = HTML (string=source,
-            base_url=os.path.dirname (template.filename))
-    pdfBytes = html.write_pdf(font_config=FontConfiguration())
-    return pdfBytes
+    return html2pdf(source, os.path.dirname (template.filename))
 
 
 _year = 2016